@@ -0,0 +1,106 @@
+"""Нагрузочная проверка: одновременные запросы /balance не выполняются по очереди.
+
+Воспроизводит обращение обработчика /balance к базе (поиск пользователя
+по telegram_id) для многих пользователей сразу, сначала по одному, затем
+одновременно, и следит за задержкой цикла событий. С блокирующим pymongo
+каждый запрос занимал цикл целиком, и одновременные запросы шли строго
+друг за другом. Завершается с кодом 1, если это снова так.
+
+    python balance_loadtest.py --mongo mongodb://localhost:27017 --users 1000
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+import config
+
+from db import Database
+
+# Допустимая задержка цикла событий во время нагрузки (секунды)
+MAX_LOOP_LAG = 0.05
+
+
+async def watch_loop_lag(stop_event, interval=0.001):
+    """Максимальное опоздание пробуждения корутины, пока идет нагрузка."""
+    worst = 0.0
+    while not stop_event.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - started - interval)
+    return worst
+
+
+async def check_concurrent_balance(uri, db_name, users, concurrency):
+    """Возвращает список нарушений; пустой список - проверка пройдена."""
+    database = Database(uri, name=db_name)
+    await database.client.drop_database(db_name)
+    await database.users.insert_many([
+        {"name": f"Участник {i:06d}", "telegram_id": i, "is_admin": False, "amount_paid": 100}
+        for i in range(users)
+    ])
+
+    in_flight = 0
+    peak = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def balance(telegram_id):
+        nonlocal in_flight, peak
+        async with semaphore:
+            in_flight += 1
+            peak = max(peak, in_flight)
+            try:
+                user = await database.users.find_one({"telegram_id": telegram_id})
+            finally:
+                in_flight -= 1
+        return user['amount_paid']
+
+    try:
+        started = time.perf_counter()
+        for telegram_id in range(users):
+            await balance(telegram_id)
+        sequential = time.perf_counter() - started
+
+        peak = 0
+        stop_event = asyncio.Event()
+        lag_task = asyncio.create_task(watch_loop_lag(stop_event))
+        started = time.perf_counter()
+        results = await asyncio.gather(*(balance(telegram_id) for telegram_id in range(users)))
+        concurrent = time.perf_counter() - started
+        stop_event.set()
+        lag = await lag_task
+    finally:
+        await database.client.drop_database(db_name)
+        database.close()
+
+    print(f"{users} запросов /balance")
+    print(f"  по одному: {sequential * 1000:.0f} мс")
+    print(f"  одновременно: {concurrent * 1000:.0f} мс, в работе до {peak}, задержка цикла {lag * 1000:.1f} мс")
+
+    errors = []
+    if results != [100] * users:
+        errors.append("одновременные запросы вернули неверные балансы")
+    if peak < 2:
+        errors.append("запросы выполнялись строго по одному")
+    if concurrent >= sequential:
+        errors.append("одновременные запросы не быстрее последовательных")
+    if lag > MAX_LOOP_LAG:
+        errors.append(f"цикл событий блокировался на {lag * 1000:.0f} мс")
+    return errors
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Проверка одновременных запросов /balance")
+    parser.add_argument('--mongo', default=getattr(config, 'MONGO', 'mongodb://localhost:27017'))
+    parser.add_argument('--db-name', default='club_bot_balance_loadtest')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100, help="одновременно выполняемых запросов")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    failures = asyncio.run(check_concurrent_balance(args.mongo, args.db_name, args.users, args.concurrency))
+    for failure in failures:
+        print(f"ОШИБКА: {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import time
+
+import config
+from telegram.error import BadRequest, Forbidden, RetryAfter, TimedOut, NetworkError
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений в секунду всего и 1 сообщение в секунду в один чат
+GLOBAL_RATE = getattr(config, 'BROADCAST_GLOBAL_RATE', 30)
+PER_CHAT_INTERVAL = getattr(config, 'BROADCAST_PER_CHAT_INTERVAL', 1.0)
+CONCURRENCY = getattr(config, 'BROADCAST_CONCURRENCY', 20)
+MAX_RETRIES = getattr(config, 'BROADCAST_MAX_RETRIES', 3)
+# Как часто (в отправленных сообщениях) обновлять отчет о прогрессе
+PROGRESS_EVERY = getattr(config, 'BROADCAST_PROGRESS_EVERY', 50)
+
+
+class TokenBucket:
+    """Ведро токенов: не более `rate` операций в секунду с запасом `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class PerChatLimiter:
+    """Выдерживает минимальный интервал между сообщениями в один и тот же чат."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.last_sent = {}
+
+    async def wait(self, chat_id):
+        now = time.monotonic()
+        ready_at = self.last_sent.get(chat_id, 0) + self.interval
+        self.last_sent[chat_id] = max(now, ready_at)
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+
+    def prune(self):
+        # Забываем чаты, которым давно ничего не отправляли
+        threshold = time.monotonic() - self.interval
+        self.last_sent = {chat_id: ts for chat_id, ts in self.last_sent.items() if ts > threshold}
+
+
+# Общие лимитеры на процесс, чтобы параллельные рассылки не превышали лимиты вместе
+global_bucket = TokenBucket(GLOBAL_RATE)
+per_chat_limiter = PerChatLimiter(PER_CHAT_INTERVAL)
+
+
+def share_global_rate(process_count):
+    """Делит общий лимит бота между процессами, которые отправляют сообщения одновременно."""
+    global_bucket.rate = GLOBAL_RATE / process_count
+    global_bucket.capacity = global_bucket.tokens = max(global_bucket.rate, 1)
+
+
+async def send_with_retry(bot, chat_id, text, **kwargs):
+    """Отправляет сообщение с учетом лимитов и повторяет при RetryAfter/TimedOut.
+
+    Возвращает True, если сообщение доставлено.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        await global_bucket.acquire()
+        await per_chat_limiter.wait(chat_id)
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            return True
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            if hasattr(retry_after, 'total_seconds'):
+                retry_after = retry_after.total_seconds()
+            logger.warning(f"Превышен лимит при отправке {chat_id}, ждем {retry_after} с")
+            await asyncio.sleep(retry_after)
+        except Forbidden as e:
+            # Пользователь заблокировал бота - повторять бессмысленно
+            logger.info(f"Пользователь {chat_id} недоступен: {e}")
+            return False
+        except BadRequest as e:
+            # Подкласс NetworkError, но ошибка постоянная: чат не найден, слишком длинный текст
+            logger.error(f"Telegram отклонил сообщение пользователю {chat_id}: {e}")
+            return False
+        except (TimedOut, NetworkError) as e:
+            logger.warning(f"Ошибка сети при отправке {chat_id} (попытка {attempt + 1}): {e}")
+            await asyncio.sleep(2 ** attempt)
+        except Exception as e:
+            logger.error(f"Не удалось отправить сообщение пользователю {chat_id}: {e}")
+            return False
+    return False
+
+
+async def broadcast(bot, chat_ids, text, report_chat_id=None):
+    """Рассылает `text` всем `chat_ids` параллельно и отчитывается админу.
+
+    Возвращает пару (доставлено, не доставлено).
+    """
+    chat_ids = list(dict.fromkeys(chat_ids))
+    total = len(chat_ids)
+    sent = 0
+    failed = 0
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    progress_message = None
+    if report_chat_id is not None:
+        progress_message = await bot.send_message(
+            chat_id=report_chat_id, text=f"Рассылка начата: 0/{total}"
+        )
+
+    async def report_progress():
+        if progress_message is None:
+            return
+        try:
+            await progress_message.edit_text(
+                f"Рассылка: {sent + failed}/{total} (доставлено {sent}, ошибок {failed})"
+            )
+        except Exception as e:
+            logger.debug(f"Не удалось обновить прогресс рассылки: {e}")
+
+    async def worker(chat_id):
+        nonlocal sent, failed
+        async with semaphore:
+            if await send_with_retry(bot, chat_id, text):
+                sent += 1
+            else:
+                failed += 1
+            if (sent + failed) % PROGRESS_EVERY == 0 and sent + failed < total:
+                await report_progress()
+
+    await asyncio.gather(*(worker(chat_id) for chat_id in chat_ids))
+    per_chat_limiter.prune()
+
+    logger.info(f"Рассылка завершена: доставлено {sent}, ошибок {failed}")
+    if report_chat_id is not None:
+        await bot.send_message(
+            chat_id=report_chat_id,
+            text=f"Уведомление отправлено.\nДоставлено: {sent}\nНе доставлено: {failed}"
+        )
+    return sent, failed
@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+
+import config
+from pymongo import ReturnDocument
+
+# Срок, на который выдается вещь (дни)
+LOAN_DAYS = getattr(config, 'EQUIPMENT_LOAN_DAYS', 14)
+# Сколько последних записей истории хранить в документе вещи
+HISTORY_LIMIT = getattr(config, 'EQUIPMENT_HISTORY_LIMIT', 50)
+
+
+async def checkout_item(collection, name, holder_id, holder_name=None, loan_days=LOAN_DAYS):
+    """Выдает вещь одним условным обновлением.
+
+    Вещь выдается, только если она сейчас доступна, поэтому из нескольких
+    одновременных запросов успешен ровно один. Возвращает обновленный
+    документ или None, если вещь не найдена или уже выдана.
+    """
+    now = datetime.now()
+    return await collection.find_one_and_update(
+        {"name": name, "available": {"$ne": False}},
+        {
+            "$set": {
+                "available": False,
+                "holder": {"telegram_id": holder_id, "name": holder_name},
+                "checked_out_at": now,
+                "due_at": now + timedelta(days=loan_days),
+            },
+            "$push": {"history": {
+                "$each": [{"action": "checkout", "telegram_id": holder_id, "at": now}],
+                "$slice": -HISTORY_LIMIT,
+            }},
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def return_item(collection, name, holder_id=None, returned_by=None):
+    """Возвращает выданную вещь. Если указан holder_id, вернуть может только он.
+
+    Возвращает обновленный документ или None, если вещь не выдана
+    (или выдана другому пользователю).
+    """
+    query = {"name": name, "available": False}
+    if holder_id is not None:
+        query["holder.telegram_id"] = holder_id
+    now = datetime.now()
+    return await collection.find_one_and_update(
+        query,
+        {
+            "$set": {"available": True},
+            "$unset": {"holder": "", "checked_out_at": "", "due_at": ""},
+            "$push": {"history": {
+                "$each": [{"action": "return", "telegram_id": returned_by or holder_id, "at": now}],
+                "$slice": -HISTORY_LIMIT,
+            }},
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def stress_checkout(uri, contenders=100):
+    """Нагрузочная проверка: `contenders` одновременных запросов одной вещи.
+
+    Проверяет, что вещь выдана ровно одному пользователю, что вернуть ее
+    может только он и только один раз. Работает на временной коллекции
+    и удаляет ее после проверки. Возвращает список нарушений (пустой, если их нет).
+    """
+    import asyncio
+    from db import Database
+
+    database = Database(uri)
+    collection = database.db["equipment_stress_test"]
+    errors = []
+    try:
+        await collection.drop()
+        await collection.insert_one({"name": "Палатка", "description": "тест", "available": True})
+
+        results = await asyncio.gather(*(
+            checkout_item(collection, "Палатка", holder_id=i) for i in range(contenders)
+        ))
+        winners = [doc["holder"]["telegram_id"] for doc in results if doc is not None]
+        print(f"{contenders} одновременных запросов, выдано: {len(winners)} (пользователь {winners})")
+        if len(winners) != 1:
+            errors.append(f"вещь выдана {len(winners)} раз вместо одного")
+            return errors
+
+        doc = await collection.find_one({"name": "Палатка"})
+        if doc.get("available") is not False or doc["holder"]["telegram_id"] != winners[0]:
+            errors.append("в базе записан не тот держатель")
+
+        others = [i for i in range(contenders) if i != winners[0]]
+        stolen = await asyncio.gather(*(return_item(collection, "Палатка", holder_id=i) for i in others))
+        if any(doc is not None for doc in stolen):
+            errors.append("вещь вернул пользователь, которому она не выдавалась")
+
+        returns = await asyncio.gather(*(
+            return_item(collection, "Палатка", holder_id=winners[0]) for _ in range(contenders)
+        ))
+        if sum(doc is not None for doc in returns) != 1:
+            errors.append("возврат выполнен не ровно один раз")
+    finally:
+        await collection.drop()
+        database.close()
+    return errors
+
+
+if __name__ == '__main__':
+    import asyncio
+    import sys
+
+    failures = asyncio.run(stress_checkout(config.MONGO))
+    for failure in failures:
+        print(f"ОШИБКА: {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,127 @@
+import logging
+
+import config
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+
+from metrics import InstrumentedCollection
+
+logger = logging.getLogger(__name__)
+
+# Имя базы данных бота
+DB_NAME = "club_bot_db"
+
+
+class Database:
+    """Асинхронный доступ к коллекциям MongoDB через motor.
+
+    Все операции возвращают корутины, поэтому обработчики не блокируют
+    цикл событий во время обращения к базе.
+    """
+
+    def __init__(self, uri, name=None, max_pool_size=None):
+        if name is None:
+            name = getattr(config, 'MONGO_DB_NAME', DB_NAME)
+        if max_pool_size is None:
+            max_pool_size = getattr(config, 'MONGO_POOL_SIZE', 50)
+        # Клиент не подключается при создании; первый запрос ждет сервер
+        # не дольше MONGO_SERVER_SELECTION_TIMEOUT_MS, а не 30 с по умолчанию
+        self.client = AsyncIOMotorClient(
+            uri,
+            maxPoolSize=max_pool_size,
+            minPoolSize=getattr(config, 'MONGO_MIN_POOL_SIZE', 0),
+            connectTimeoutMS=getattr(config, 'MONGO_CONNECT_TIMEOUT_MS', 5000),
+            serverSelectionTimeoutMS=getattr(config, 'MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000),
+        )
+        self.db = self.client[name]
+        self.users = self.collection("users")
+        self.registration_requests = self.collection("registration_requests")
+        self.payment_requests = self.collection("payment_requests")
+        self.equipment = self.collection("equipment")
+        self.ledger = self.collection("ledger")
+        self.transactions_supported = None
+
+    def collection(self, name):
+        """Коллекция, операции с которой попадают в метрики."""
+        return InstrumentedCollection(self.db[name])
+
+    def close(self):
+        self.client.close()
+
+    async def supports_transactions(self):
+        """Транзакции доступны только в наборе реплик или через mongos."""
+        if self.transactions_supported is None:
+            hello = await self.client.admin.command("hello")
+            self.transactions_supported = "setName" in hello or hello.get("msg") == "isdbgrid"
+        return self.transactions_supported
+
+    async def run_transaction(self, callback):
+        """Выполняет `callback(session)` в транзакции, если она доступна.
+
+        На одиночном сервере callback вызывается с session=None, и каждая
+        операция внутри него атомарна только сама по себе.
+        """
+        if not await self.supports_transactions():
+            return await callback(None)
+        async with await self.client.start_session() as session:
+            return await session.with_transaction(callback)
+
+    async def ensure_indexes(self):
+        """Создает индексы для горячих запросов. Безопасно вызывать повторно."""
+        pending_only = {"partialFilterExpression": {"status": "pending"}}
+        specs = [
+            (self.users, [("telegram_id", ASCENDING)], {"unique": True}),
+            # Имя не уникально: одобренный запрос на регистрацию добавляет
+            # второй Telegram-аккаунт к уже зарегистрированному имени
+            # Составной ключ также служит для постраничного вывода списка
+            (self.users, [("name", ASCENDING), ("_id", ASCENDING)], {}),
+            # Порядок выдачи запросов в очереди просмотра
+            (self.registration_requests, [("status", ASCENDING), ("queued_at", ASCENDING), ("_id", ASCENDING)], pending_only),
+            (self.payment_requests, [("status", ASCENDING), ("queued_at", ASCENDING), ("_id", ASCENDING)], pending_only),
+            # Не больше одного ожидающего запроса на регистрацию от одного аккаунта
+            (self.registration_requests, [("telegram_id", ASCENDING)], {"unique": True, **pending_only}),
+            (self.payment_requests, [("telegram_id", ASCENDING), ("status", ASCENDING)], {}),
+            (self.payment_requests, [("receipt_hash", ASCENDING)], {"sparse": True}),
+            # Проверка недавно одобренных платежей и очистка старых квитанций
+            (self.payment_requests, [("status", ASCENDING), ("resolved_at", ASCENDING)], {}),
+            (self.equipment, [("name", ASCENDING)], {"unique": True}),
+            (self.equipment, [("holder.telegram_id", ASCENDING)], {"sparse": True}),
+            (self.users, [("amount_paid", ASCENDING)], {}),
+            (self.ledger, [("payment_request_id", ASCENDING)], {"unique": True}),
+            (self.ledger, [("telegram_id", ASCENDING), ("created_at", ASCENDING)], {}),
+            (self.ledger, [("period", ASCENDING)], {}),
+            # Записи, зачисление которых на баланс еще не подтверждено
+            (self.ledger, [("applied", ASCENDING)], {"partialFilterExpression": {"applied": False}}),
+        ]
+        for collection, keys, options in specs:
+            try:
+                await collection.create_index(keys, **options)
+            except OperationFailure as e:
+                # Например, дубликаты в существующих данных мешают уникальному индексу
+                logger.error(f"Не удалось создать индекс {keys} в {collection.name}: {e}")
+
+    async def explain_hot_queries(self):
+        """Возвращает список (описание запроса, стадии плана) для горячих запросов."""
+        queries = [
+            ("users по telegram_id", self.users, {"telegram_id": 0}),
+            ("users по name", self.users, {"name": ""}),
+            ("pending registration_requests", self.registration_requests, {"status": "pending"}),
+            ("pending payment_requests", self.payment_requests, {"status": "pending"}),
+            ("equipment по name", self.equipment, {"name": ""}),
+        ]
+        result = []
+        for title, collection, query in queries:
+            plan = await collection.find(query).explain()
+            winning_plan = plan.get("queryPlanner", {}).get("winningPlan", {})
+            result.append((title, plan_stages(winning_plan)))
+        return result
+
+
+def plan_stages(plan):
+    """Собирает стадии плана выполнения сверху вниз, например ['FETCH', 'IXSCAN']."""
+    stages = []
+    while plan:
+        stages.append(plan.get("stage", "?"))
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return stages
@@ -0,0 +1,152 @@
+import calendar
+from datetime import datetime, timedelta
+
+import config
+from pymongo import UpdateOne
+
+# Взнос за один платежный период (календарный месяц)
+required_payment = config.PAYMENT
+
+# Начало первого платежного периода
+payment_start_date = config.START_DATE
+
+
+def add_months(date, months):
+    """Сдвигает дату на `months` календарных месяцев, обрезая день до конца месяца."""
+    month_index = date.month - 1 + months
+    year = date.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(date.day, calendar.monthrange(year, month)[1])
+    return date.replace(year=year, month=month, day=day)
+
+
+def periods_due(today=None):
+    """Количество начавшихся к `today` платежных периодов (включая текущий)."""
+    today = today or datetime.now()
+    if today < payment_start_date:
+        return 0
+    months = (today.year - payment_start_date.year) * 12 + today.month - payment_start_date.month
+    if add_months(payment_start_date, months) > today:
+        months -= 1
+    return months + 1
+
+
+def period_key(date):
+    """Ключ периода, к которому относится дата, например '2023-10'."""
+    index = max(periods_due(date) - 1, 0)
+    return add_months(payment_start_date, index).strftime("%Y-%m")
+
+
+def total_required(today=None):
+    """Сумма, которую каждый участник должен был внести к `today`."""
+    return required_payment * periods_due(today)
+
+
+def user_balance(user, today=None):
+    """Баланс пользователя: положительный - переплата, отрицательный - долг."""
+    return user.get('amount_paid', 0) - total_required(today)
+
+
+def next_payment_date(user):
+    """Начало первого периода, не покрытого платежами пользователя."""
+    periods_covered = int(user.get('amount_paid', 0) // required_payment)
+    return add_months(payment_start_date, periods_covered)
+
+
+def debtors_filter(today=None):
+    """Фильтр MongoDB для должников по текущему балансу."""
+    return {"amount_paid": {"$lt": total_required(today)}}
+
+
+def not_debtors_filter(today=None):
+    return {"amount_paid": {"$gte": total_required(today)}}
+
+
+async def record_payments(database, requests, approved_at=None, session=None):
+    """Записывает одобренные платежи в журнал и зачисляет их на балансы.
+
+    Запись в журнале уникальна по payment_request_id и создается с
+    applied: False; зачисление идет в apply_entries. Повторная обработка
+    тех же запросов не изменит баланс второй раз. Возвращает запросы,
+    записи для которых добавил именно этот вызов.
+    """
+    if not requests:
+        return []
+    approved_at = approved_at or datetime.now()
+    result = await database.ledger.bulk_write([
+        UpdateOne(
+            {"payment_request_id": request['_id']},
+            {'$setOnInsert': {
+                "payment_request_id": request['_id'],
+                "telegram_id": request['telegram_id'],
+                "amount": request['amount'],
+                "period": period_key(request.get('resolved_at', approved_at)),
+                "created_at": request.get('resolved_at', approved_at),
+                "applied": False,
+            }},
+            upsert=True,
+        )
+        for request in requests
+    ], session=session)
+
+    # Новые записи и записи, зачисление которых прервалось раньше
+    entries = await database.ledger.find(
+        {"payment_request_id": {"$in": [request['_id'] for request in requests]}, "applied": False},
+        session=session,
+    ).to_list(None)
+    await apply_entries(database, entries, session=session)
+    return [requests[index] for index in result.upserted_ids]
+
+
+async def apply_entries(database, entries, session=None):
+    """Зачисляет суммы записей журнала на балансы и отмечает записи applied.
+
+    Зачисление идемпотентно само по себе: id запроса добавляется в
+    applied_payments пользователя той же атомарной операцией, что и $inc,
+    и повторное зачисление не проходит по условию. Поэтому сбой между
+    $inc и отметкой записи исправляется повторным вызовом.
+    """
+    if not entries:
+        return
+    await database.users.bulk_write([
+        UpdateOne(
+            {"telegram_id": entry['telegram_id'], "applied_payments": {"$ne": entry['payment_request_id']}},
+            {
+                '$inc': {'amount_paid': entry['amount']},
+                '$push': {'applied_payments': entry['payment_request_id']},
+            },
+        )
+        for entry in entries
+    ], ordered=False, session=session)
+    await database.ledger.update_many(
+        {"_id": {"$in": [entry['_id'] for entry in entries]}},
+        {"$set": {"applied": True}},
+        session=session,
+    )
+
+
+async def apply_pending_entries(database):
+    """Дозачисляет записи журнала, оставшиеся с applied: False после сбоя. Возвращает эти записи."""
+    entries = await database.ledger.find({"applied": False}).to_list(None)
+    await apply_entries(database, entries)
+    return entries
+
+
+async def unrecorded_payments(database, days):
+    """Одобренные за `days` дней запросы, для которых нет записи в журнале.
+
+    Без транзакций сбой между сменой статуса и записью в журнал оставляет
+    такие запросы; их можно передать в record_payments повторно.
+    """
+    since = datetime.now() - timedelta(days=days)
+    return await database.payment_requests.aggregate([
+        {"$match": {"status": "approved", "resolved_at": {"$gte": since}}},
+        {"$lookup": {
+            "from": database.ledger.name,
+            "localField": "_id",
+            "foreignField": "payment_request_id",
+            "as": "entry",
+        }},
+        {"$match": {"entry": {"$size": 0}}},
+        {"$project": {"entry": 0}},
+    ]).to_list(None)
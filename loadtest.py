@@ -0,0 +1,466 @@
+"""Нагрузочное тестирование бота без Telegram.
+
+Запускает настоящие Application и обработчики из main.py против локальной
+имитации Bot API и отдельной базы в локальном mongod, воспроизводит
+сценарии и печатает p50/p99 задержки и обновления в секунду. Перед сценариями
+печатается время холодного запуска до обработки первого обновления.
+
+Сценарий workers запускает рабочие процессы main.py (--role worker) над общей
+очередью обновлений и сравнивает пропускную способность при разном их числе.
+
+    python loadtest.py --mongo mongodb://localhost:27017 --scenarios balance review
+    python loadtest.py --scenarios workers --worker-counts 1 2 4 8
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+import config
+from motor.motor_asyncio import AsyncIOMotorClient
+from tornado.httpserver import HTTPServer
+from tornado.web import Application as WebApplication, RequestHandler
+
+SCENARIOS = ['balance', 'register', 'payments', 'review', 'broadcast', 'workers']
+
+BOT_ID = 100000
+ADMIN_ID = 1
+FIRST_USER_ID = 10000
+
+# Минимальный корректный JPEG 1x1; к нему дописывается file_id, чтобы хэши квитанций различались
+TINY_JPEG = base64.b64decode(
+    "/9j/4AAQSkZJRgABAQEASABIAAD/2wBDAP//////////////////////////////////////////////"
+    "////////////////////////////////////////wgALCAABAAEBAREA/8QAFBABAAAAAAAAAAAAAAAA"
+    "AAAAAP/aAAgBAQABPxA="
+)
+
+
+# Имитация Bot API
+
+class FakeBotApi:
+    """Отвечает на методы Bot API правдоподобными объектами с заданной задержкой."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = Counter()
+        self.message_ids = itertools.count(1)
+        self.file_ids = itertools.count(1)
+
+    def message(self, chat_id, **extra):
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "Loadtest"},
+            **extra,
+        }
+
+    def respond(self, method, params):
+        if method == "getMe":
+            return {"id": BOT_ID, "is_bot": True, "first_name": "Loadtest", "username": "loadtest_bot"}
+        if method in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+            return self.message(params.get("chat_id", ADMIN_ID), text=params.get("text", ""))
+        if method == "sendPhoto":
+            n = next(self.file_ids)
+            photo = [{"file_id": f"sent{n}", "file_unique_id": f"sent{n}", "width": 640, "height": 480}]
+            return self.message(params.get("chat_id", ADMIN_ID), photo=photo)
+        if method == "getFile":
+            file_id = params.get("file_id", "file")
+            return {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_size": len(TINY_JPEG) + len(file_id),
+                "file_path": f"photos/{file_id}.jpg",
+            }
+        if method == "getUpdates":
+            return []
+        return True
+
+
+class BotApiHandler(RequestHandler):
+    def initialize(self, api):
+        self.api = api
+
+    async def post(self, token, method):
+        params = {key: self.get_argument(key) for key in self.request.arguments}
+        if self.request.headers.get("Content-Type", "").startswith("application/json") and self.request.body:
+            params.update(json.loads(self.request.body))
+        self.api.calls[method] += 1
+        if self.api.latency:
+            await asyncio.sleep(self.api.latency)
+        self.write({"ok": True, "result": self.api.respond(method, params)})
+
+    get = post
+
+
+class FileHandler(RequestHandler):
+    def initialize(self, api):
+        self.api = api
+
+    async def get(self, token, path):
+        self.api.calls["download"] += 1
+        if self.api.latency:
+            await asyncio.sleep(self.api.latency)
+        self.write(TINY_JPEG + os.path.basename(path).encode())
+
+
+def start_fake_api(api, port):
+    web_app = WebApplication([
+        (r"/bot([^/]+)/(\w+)", BotApiHandler, {"api": api}),
+        (r"/file/bot([^/]+)/(.+)", FileHandler, {"api": api}),
+    ])
+    server = HTTPServer(web_app)
+    server.listen(port, address="127.0.0.1")
+    return server
+
+
+# Построение обновлений
+
+update_ids = itertools.count(1)
+
+
+def user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+
+def message_update(user_id, text=None, photo_id=None):
+    message = {
+        "message_id": next(update_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": user(user_id),
+    }
+    if text is not None:
+        message["text"] = text
+        if text.startswith('/'):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    if photo_id is not None:
+        message["photo"] = [{
+            "file_id": photo_id, "file_unique_id": photo_id,
+            "width": 800, "height": 600, "file_size": 50_000,
+        }]
+    return {"update_id": next(update_ids), "message": message}
+
+
+def callback_update(user_id, data):
+    return {
+        "update_id": next(update_ids),
+        "callback_query": {
+            "id": str(next(update_ids)),
+            "from": user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": next(update_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": BOT_ID, "is_bot": True, "first_name": "Loadtest"},
+                "text": "menu",
+            },
+        },
+    }
+
+
+# Запуск сценариев
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * q), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def report(name, latencies, elapsed, extra=""):
+    latencies = sorted(latencies)
+    rate = len(latencies) / elapsed if elapsed else 0.0
+    print(
+        f"{name:<10} обновлений {len(latencies):>6}  "
+        f"p50 {percentile(latencies, 0.5) * 1000:7.1f} мс  "
+        f"p99 {percentile(latencies, 0.99) * 1000:7.1f} мс  "
+        f"{rate:8.1f} обн/с  {extra}"
+    )
+
+
+async def run_sequences(app, sequences, concurrency):
+    """Прогоняет последовательности обновлений: внутри одной - по порядку, между ними - параллельно."""
+    from telegram import Update
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def run_sequence(sequence):
+        async with semaphore:
+            for data in sequence:
+                started = time.perf_counter()
+                await app.process_update(Update.de_json(data, app.bot))
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_sequence(sequence) for sequence in sequences))
+    return latencies, time.perf_counter() - started
+
+
+async def seed_users(main, count, amount_paid=0):
+    await main.users_col.insert_many([
+        {
+            "name": f"Участник {i:06d}",
+            "telegram_id": FIRST_USER_ID + i,
+            "is_admin": False,
+            "amount_paid": amount_paid,
+        }
+        for i in range(count)
+    ])
+
+
+async def reset_database(main):
+    for name in await main.database.db.list_collection_names():
+        if name not in ("users",):
+            await main.database.db[name].delete_many({})
+    await main.users_col.delete_many({"telegram_id": {"$ne": ADMIN_ID}})
+    main.user_cache.clear()
+
+
+async def scenario_balance(main, app, args):
+    await seed_users(main, args.users)
+    sequences = [[message_update(FIRST_USER_ID + i, "/balance")] for i in range(args.users)]
+    latencies, elapsed = await run_sequences(app, sequences, args.concurrency)
+    report("balance", latencies, elapsed)
+
+
+async def scenario_register(main, app, args):
+    sequences = [
+        [
+            message_update(FIRST_USER_ID + i, "/register"),
+            message_update(FIRST_USER_ID + i, f"Участник {i:06d}"),
+            message_update(FIRST_USER_ID + i, "Нет"),
+        ]
+        for i in range(args.users)
+    ]
+    latencies, elapsed = await run_sequences(app, sequences, args.concurrency)
+    registered = await main.users_col.count_documents({"telegram_id": {"$gte": FIRST_USER_ID}})
+    report("register", latencies, elapsed, f"зарегистрировано {registered}")
+
+
+async def scenario_payments(main, app, args):
+    await seed_users(main, args.users)
+    sequences = [
+        [
+            message_update(FIRST_USER_ID + i, "/payment"),
+            message_update(FIRST_USER_ID + i, "100"),
+            message_update(FIRST_USER_ID + i, photo_id=f"receipt{i}"),
+        ]
+        for i in range(args.users)
+    ]
+    latencies, elapsed = await run_sequences(app, sequences, args.concurrency)
+
+    # Дожидаемся фоновой обработки квитанций
+    started = time.perf_counter()
+    await main.receipt_workers.queue.join()
+    drained = time.perf_counter() - started
+    pending = await main.payment_requests_col.count_documents({"status": "pending"})
+    report("payments", latencies, elapsed, f"квитанции обработаны за +{drained:.1f} с, pending {pending}")
+
+
+async def scenario_review(main, app, args):
+    await seed_users(main, args.pending)
+    now = datetime.now()
+    await main.payment_requests_col.insert_many([
+        {
+            "telegram_id": FIRST_USER_ID + i,
+            "amount": 100,
+            "receipt_file_id": f"receipt{i}",
+            "status": "pending",
+            "queued_at": now,
+        }
+        for i in range(args.pending)
+    ])
+    sequence = [callback_update(ADMIN_ID, "manage_payments")]
+    sequence += [callback_update(ADMIN_ID, "approve_payment") for _ in range(args.pending)]
+    latencies, elapsed = await run_sequences(app, [sequence], 1)
+    approved = await main.payment_requests_col.count_documents({"status": "approved"})
+    report("review", latencies, elapsed, f"одобрено {approved}")
+
+
+async def scenario_broadcast(main, app, args):
+    await seed_users(main, args.broadcast_users)
+    user_ids = [FIRST_USER_ID + i for i in range(args.broadcast_users)]
+    started = time.perf_counter()
+    sent, failed = await main.broadcast(app.bot, user_ids, "Нагрузочный тест")
+    elapsed = time.perf_counter() - started
+    print(
+        f"{'broadcast':<10} сообщений {sent + failed:>6}  доставлено {sent}, ошибок {failed}  "
+        f"{elapsed:.1f} с  {(sent + failed) / elapsed:8.1f} сообщ/с"
+    )
+
+
+async def scenario_workers(main, app, args):
+    """Пропускная способность общей очереди при разном числе рабочих процессов.
+
+    Каждый рабочий процесс - отдельный интерпретатор со своим Application,
+    как при запуске main.py --role worker; имитация Bot API остается в этом
+    процессе. Время считается от постановки обновлений в очередь до ее
+    опустошения, запуск процессов в него не входит.
+    """
+    await seed_users(main, args.users)
+    queue = main.shared_update_queue
+    await queue.ensure_indexes()
+    for count in args.worker_counts:
+        workers = [
+            await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__),
+                '--worker-child', str(index), str(count), '--workdir', args.workdir,
+                '--mongo', args.mongo, '--db-name', args.db_name, '--api-port', str(args.api_port),
+                stdout=asyncio.subprocess.PIPE,
+            )
+            for index in range(count)
+        ]
+        try:
+            for worker in workers:
+                if await worker.stdout.readline() != b"ready\n":
+                    raise RuntimeError(f"Рабочий процесс завершился с кодом {await worker.wait()}")
+
+            updates = [message_update(FIRST_USER_ID + i, "/balance") for i in range(args.users)]
+            started = time.perf_counter()
+            await asyncio.gather(*(queue.put(data) for data in updates))
+            while await queue.collection.count_documents({}):
+                await asyncio.sleep(0.05)
+            elapsed = time.perf_counter() - started
+        finally:
+            for worker in workers:
+                if worker.returncode is None:
+                    worker.send_signal(signal.SIGTERM)
+            await asyncio.gather(*(worker.wait() for worker in workers))
+        print(
+            f"{'workers':<10} процессов {count:>2}  обновлений {len(updates):>6}  "
+            f"{elapsed:.1f} с  {len(updates) / elapsed:8.1f} обн/с"
+        )
+
+
+def configure(args, workdir):
+    """Подменяет настройки до импорта main, который читает их при загрузке и запуске."""
+    config.TOKEN = "123456:loadtest"
+    config.MONGO = args.mongo
+    config.MONGO_DB_NAME = args.db_name
+    config.BOT_API_BASE_URL = f"http://127.0.0.1:{args.api_port}"
+    config.NAMES_FILE = os.path.join(workdir, "names.txt")
+    config.RECEIPTS_DIR = os.path.join(workdir, "receipts")
+    config.RECEIPT_BACKEND = 'local'
+    # Сценарии шлют сотни обновлений от одного администратора подряд
+    config.FLOOD_LIMIT = 0
+    if args.unlimited_broadcast:
+        config.BROADCAST_GLOBAL_RATE = 1_000_000
+        config.BROADCAST_PER_CHAT_INTERVAL = 0
+
+
+async def run_worker_child(args):
+    """Рабочий процесс сценария workers: то же, что main.py --role worker."""
+    index, count = args.worker_child
+    configure(args, args.workdir)
+    # Порт метрик занят родительским процессом
+    config.METRICS_PORT = None
+    import main
+    from shared_queue import consume_partition
+    from webhook import start_application, stop_application, stop_signal_event
+
+    main.configure_worker(index, count)
+    app = main.build_application(with_updater=False)
+    queue = main.shared_update_queue
+    stop_event = stop_signal_event()
+    partitions = [p for p in range(queue.partitions) if p % count == index]
+    await start_application(app)
+    # Родительский процесс ставит обновления в очередь только после этой строки
+    print("ready", flush=True)
+    try:
+        await asyncio.gather(*(
+            consume_partition(app, queue, partition, f"worker-{index}", stop_event)
+            for partition in partitions
+        ))
+    finally:
+        await stop_application(app)
+
+
+async def run(args):
+    port = args.api_port
+    api = FakeBotApi(args.api_latency / 1000)
+    server = start_fake_api(api, port)
+
+    workdir = args.workdir = tempfile.mkdtemp(prefix="loadtest_")
+    with open(os.path.join(workdir, "names.txt"), 'w', encoding='utf-8') as file:
+        file.write("\n".join(f"Участник {i:06d}" for i in range(max(args.users, args.pending, 1))))
+    configure(args, workdir)
+
+    # Замер холодного запуска: импорт, сборка приложения, запуск и первое обновление
+    started = time.perf_counter()
+    import main
+    from telegram import Update
+    from webhook import start_application, stop_application
+    imported = time.perf_counter()
+
+    app = main.build_application(with_updater=False)
+    built = time.perf_counter()
+    await main.database.client.drop_database(args.db_name)
+    await main.users_col.insert_one({"name": "Админ", "telegram_id": ADMIN_ID, "is_admin": True, "amount_paid": 0})
+    seeded = time.perf_counter()
+
+    await start_application(app)
+    ready = time.perf_counter()
+    await app.process_update(Update.de_json(message_update(ADMIN_ID, "/start"), app.bot))
+    first_update = time.perf_counter()
+    print(
+        f"{'startup':<10} импорт {(imported - started) * 1000:.0f} мс  "
+        f"сборка {(built - imported) * 1000:.0f} мс  "
+        f"запуск {(ready - seeded) * 1000:.0f} мс  "
+        f"до первого обновления {(first_update - started - (seeded - built)) * 1000:.0f} мс"
+    )
+    try:
+        for name in args.scenarios:
+            await reset_database(main)
+            await globals()[f"scenario_{name}"](main, app, args)
+    finally:
+        await stop_application(app)
+        # Соединение бота уже закрыто в on_shutdown
+        client = AsyncIOMotorClient(args.mongo)
+        await client.drop_database(args.db_name)
+        client.close()
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("Вызовы Bot API:", ", ".join(f"{method}={count}" for method, count in api.calls.most_common()))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование бота против имитации Bot API")
+    parser.add_argument('--mongo', default=getattr(config, 'MONGO', 'mongodb://localhost:27017'))
+    parser.add_argument('--db-name', default='club_bot_loadtest')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--users', type=int, default=1000, help="пользователей в сценариях balance/register/payments")
+    parser.add_argument('--pending', type=int, default=1000, help="ожидающих платежей в сценарии review")
+    parser.add_argument('--broadcast-users', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=100, help="одновременно активных пользователей")
+    parser.add_argument('--api-latency', type=float, default=20, help="задержка имитации Bot API, мс")
+    parser.add_argument('--api-port', type=int, default=8081)
+    parser.add_argument('--unlimited-broadcast', action='store_true',
+                        help="снять лимиты Telegram в рассылке, чтобы мерить только накладные расходы")
+    parser.add_argument('--worker-counts', type=int, nargs='+', default=[1, 2, 4],
+                        help="числа рабочих процессов в сценарии workers")
+    # Служебные параметры рабочих процессов, которые запускает сценарий workers
+    parser.add_argument('--worker-child', type=int, nargs=2, metavar=('INDEX', 'COUNT'), help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    if arguments.worker_child:
+        asyncio.run(run_worker_child(arguments))
+    else:
+        asyncio.run(run(arguments))
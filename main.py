@@ -1,17 +1,21 @@
+import argparse
 import config
 import logging
 import os
+import time
 from datetime import datetime, timedelta
 from telegram import (
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     ReplyKeyboardMarkup,
+    ReplyKeyboardRemove,
     KeyboardButton,
     InputMediaPhoto,
     InputMedia,
     CallbackQuery,
 )
+from telegram.error import BadRequest
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -21,8 +25,26 @@ from telegram.ext import (
     CallbackQueryHandler,
     ConversationHandler,
 )
-import pymongo
 import asyncio
+from db import Database
+from bson import ObjectId
+from broadcast import broadcast, share_global_rate
+from cache import TTLCache, MISSING
+import ledger
+from pagination import fetch_page, page_from_sorted
+from roster import RosterProvider
+from persistence import MongoPersistence
+from review_queue import ReviewQueue
+from checkout import checkout_item, return_item
+from pymongo.errors import DuplicateKeyError
+from receipts import create_receipt_store, ReceiptError, MAX_RECEIPT_SIZE
+from workers import WorkerPool
+from shared_queue import SharedUpdateQueue, run_ingress, run_worker
+import reports
+from reminders import DebtReminders, schedule_debt_reminders
+from middleware import add_update_guard
+from outbox import Outbox, OutboxWorker
+from metrics import instrument_application, registry, start_metrics_server, summary
 
 # Настройка логирования
 logging.basicConfig(
@@ -32,30 +54,57 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-# Настройка MongoDB
-client = pymongo.MongoClient(config.MONGO)
-db = client["club_bot_db"]
-users_col = db["users"]
-registration_requests_col = db["registration_requests"]
-payment_requests_col = db["payment_requests"]
-equipment_col = db["equipment"]  # Новая коллекция для оборудования
-
-# Предопределенные имена членов клуба
-with open('names.txt', 'r', encoding='utf-8') as file:
-    club_member_names = file.read().splitlines()
-
-# Сортируем фамилии в алфавитном порядке
-club_member_names.sort()
+# Ресурсы бота создаются в create_resources() и on_startup, а не при импорте модуля,
+# чтобы импорт main был дешевым и не зависел от MongoDB и файлов
+database = None
+users_col = None
+registration_requests_col = None
+payment_requests_col = None
+equipment_col = None  # Новая коллекция для оборудования
+registration_queue = None
+payment_queue = None
+shared_update_queue = None
+debt_reminders = None
+# Уведомления пользователям, записанные вместе с изменениями, и их отправитель
+outbox = None
+outbox_worker = None
+
+# Предопределенные имена членов клуба (отсортированы по алфавиту).
+# Файл читается при запуске и перечитывается без перезапуска бота при изменении
+roster_provider = None
+
+# Хранилище квитанций (локальный каталог или GridFS, см. config.RECEIPT_BACKEND)
+receipt_store = None
+
+# Предельное время подготовки ресурсов при запуске (секунды)
+STARTUP_TIMEOUT = getattr(config, 'STARTUP_TIMEOUT', 30)
+
+def create_resources():
+    """Создает объекты доступа к данным без обращения к сети и диску.
+
+    Клиент MongoDB подключается в фоне при первом запросе; файлы читаются
+    позже, в on_startup. Повторный вызов ничего не делает.
+    """
+    global database, users_col, registration_requests_col, payment_requests_col, equipment_col
+    global registration_queue, payment_queue, shared_update_queue, debt_reminders, roster_provider, outbox
+    if database is not None:
+        return
+    database = Database(config.MONGO)
+    users_col = database.users
+    registration_requests_col = database.registration_requests
+    payment_requests_col = database.payment_requests
+    equipment_col = database.equipment
+    # Очереди запросов: администратор получает запросы по одному прямо из базы
+    registration_queue = ReviewQueue(registration_requests_col)
+    payment_queue = ReviewQueue(payment_requests_col)
+    shared_update_queue = SharedUpdateQueue(database)
+    debt_reminders = DebtReminders(database)
+    outbox = Outbox(database)
+    roster_provider = RosterProvider(getattr(config, 'NAMES_FILE', 'names.txt'))
 
 # Секретные фразы для админа
 admin_secret_phrases = [config.PWD]
 
-# Необходимая сумма оплаты за период (например, ежемесячно)
-required_payment = config.PAYMENT  # Настройте по необходимости
-
-# Начало платежного периода с октября 2023
-payment_start_date = config.START_DATE
-
 # Состояния разговора
 (
     CHOOSING_NAME,
@@ -70,11 +119,58 @@ payment_start_date = config.START_DATE
     ADD_EQUIPMENT_NAME,
     ADD_EQUIPMENT_DESCRIPTION,
     REQUEST_EQUIPMENT_ITEM,
-) = range(12)
+    RETURN_EQUIPMENT_ITEM,
+    BULK_DENY_COMMENT,
+) = range(14)
+
+# Кэш пользователей по telegram_id (записи меняются редко)
+user_cache = TTLCache(
+    maxsize=getattr(config, 'USER_CACHE_SIZE', 1024),
+    ttl=getattr(config, 'USER_CACHE_TTL', 300),
+)
+# Кэш сбрасывается только в процессе, который изменил пользователя, поэтому
+# при нескольких рабочих процессах он отключается (см. configure_worker())
+user_cache_enabled = True
+
+def user_cache_metrics():
+    stats = user_cache.stats()
+    return [
+        ("bot_user_cache_hits_total", "counter", stats['hits']),
+        ("bot_user_cache_misses_total", "counter", stats['misses']),
+        ("bot_user_cache_size", "gauge", stats['size']),
+    ]
 
-# Убедитесь, что каталог для квитанций существует
-if not os.path.exists('receipts'):
-    os.makedirs('receipts')
+registry.add_collector(user_cache_metrics)
+
+# HTTP-сервер /metrics, если задан config.METRICS_PORT
+metrics_server = None
+
+async def get_user(telegram_id):
+    """Возвращает документ пользователя или None, по возможности без запроса к базе."""
+    if not user_cache_enabled:
+        return await users_col.find_one({"telegram_id": telegram_id})
+    user = user_cache.get(telegram_id)
+    if user is MISSING:
+        user = await users_col.find_one({"telegram_id": telegram_id})
+        user_cache.set(telegram_id, user)
+    return user
+
+async def get_admin(telegram_id):
+    user = await get_user(telegram_id)
+    if user and user.get('is_admin'):
+        return user
+    return None
+
+# Выбор имени при регистрации: сколько имен показывать на странице и сколько искать
+NAME_PICKER_PAGE_SIZE = getattr(config, 'NAME_PICKER_PAGE_SIZE', 8)
+NAME_SEARCH_LIMIT = getattr(config, 'NAME_SEARCH_LIMIT', 48)
+
+# Фоновая обработка загруженных квитанций
+receipt_workers = WorkerPool(
+    'receipts',
+    size=getattr(config, 'RECEIPT_WORKERS', 4),
+    queue_size=getattr(config, 'RECEIPT_QUEUE_SIZE', 100),
+)
 
 # Функция отмены
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -111,35 +207,104 @@ async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # Регистрация пользователя
 async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user = users_col.find_one({"telegram_id": user_id})
+    user = await get_user(user_id)
     if user:
         await update.message.reply_text("Вы уже зарегистрированы.")
         return ConversationHandler.END
 
-    keyboard = [[KeyboardButton(name)] for name in club_member_names]
-    reply_markup = ReplyKeyboardMarkup(
-        keyboard, one_time_keyboard=True, resize_keyboard=True
-    )
     await update.message.reply_text(
-        "Пожалуйста, выберите свое имя из списка:", reply_markup=reply_markup
+        "Пожалуйста, введите первые буквы своей фамилии или имени:",
+        reply_markup=ReplyKeyboardRemove()
     )
     return CHOOSING_NAME
 
+def name_picker_markup(search_id, matches, page):
+    """Небольшая инлайн-клавиатура с одной страницей найденных имен.
+
+    Кнопки содержат номер поиска, чтобы клавиатура от прежнего поиска
+    не выбрала имя из нового списка.
+    """
+    start = page * NAME_PICKER_PAGE_SIZE
+    end = min(start + NAME_PICKER_PAGE_SIZE, len(matches))
+    keyboard = [
+        [InlineKeyboardButton(matches[i], callback_data=f'pick_name:{search_id}:{i}')]
+        for i in range(start, end)
+    ]
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("◀ Назад", callback_data=f'pick_page:{search_id}:{page - 1}'))
+    if end < len(matches):
+        navigation.append(InlineKeyboardButton("Далее ▶", callback_data=f'pick_page:{search_id}:{page + 1}'))
+    if navigation:
+        keyboard.append(navigation)
+    return InlineKeyboardMarkup(keyboard)
+
 async def choose_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    name = update.message.text
-    if name not in club_member_names:
-        await update.message.reply_text("Неверное имя. Регистрация не удалась.")
+    text = update.message.text.strip()
+    roster = roster_provider.roster
+    if text in roster:
+        return await confirm_name(update, context, text)
+
+    matches = roster.search(text, limit=NAME_SEARCH_LIMIT)
+    if not matches:
+        await update.message.reply_text("Совпадений не найдено. Попробуйте ввести иначе:")
+        return CHOOSING_NAME
+
+    # Сохраняем только найденные имена, в кнопках - номер поиска и номера имен
+    search_id = context.user_data.get('name_search_id', 0) + 1
+    context.user_data['name_search_id'] = search_id
+    context.user_data['name_matches'] = matches
+    await update.message.reply_text(
+        "Пожалуйста, выберите свое имя:", reply_markup=name_picker_markup(search_id, matches, 0)
+    )
+    return CHOOSING_NAME
+
+async def pick_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    action, search_id, value = query.data.split(':')
+    matches = context.user_data.get('name_matches', [])
+    if int(search_id) != context.user_data.get('name_search_id'):
+        # Клавиатура от прежнего поиска: номера в ней относятся к другому списку
+        await query.edit_message_text("Список устарел. Пожалуйста, введите имя еще раз:")
+        return CHOOSING_NAME
+
+    if action == 'pick_page':
+        await query.edit_message_reply_markup(name_picker_markup(int(search_id), matches, int(value)))
+        return CHOOSING_NAME
+
+    index = int(value)
+    if index >= len(matches):
+        await query.edit_message_text("Список устарел. Пожалуйста, введите имя еще раз:")
+        return CHOOSING_NAME
+
+    name = matches[index]
+    context.user_data.pop('name_matches', None)
+    await query.edit_message_text(f"Вы выбрали: {name}")
+    return await confirm_name(update, context, name)
+
+async def confirm_name(update: Update, context: ContextTypes.DEFAULT_TYPE, name):
+    if name not in roster_provider.roster:
+        await update.effective_message.reply_text("Неверное имя. Регистрация не удалась.")
         return ConversationHandler.END
 
-    existing_user = users_col.find_one({"name": name})
+    existing_user = await users_col.find_one({"name": name})
     if existing_user:
         # Отправить запрос на регистрацию администратору
-        registration_requests_col.insert_one({
-            "name": name,
-            "telegram_id": update.effective_user.id,
-            "status": "pending"
-        })
-        await update.message.reply_text(
+        try:
+            await registration_requests_col.insert_one({
+                "name": name,
+                "telegram_id": update.effective_user.id,
+                "status": "pending",
+                "queued_at": datetime.now()
+            })
+        except DuplicateKeyError:
+            # Уникальный частичный индекс: один ожидающий запрос на аккаунт
+            await update.effective_message.reply_text(
+                "Ваш запрос на регистрацию уже ожидает одобрения администратора."
+            )
+            return ConversationHandler.END
+        await update.effective_message.reply_text(
             "Это имя уже зарегистрировано.\nВаш запрос отправлен "
             "администратору на одобрение."
         )
@@ -150,7 +315,7 @@ async def choose_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup = ReplyKeyboardMarkup(
             keyboard, one_time_keyboard=True, resize_keyboard=True
         )
-        await update.message.reply_text(
+        await update.effective_message.reply_text(
             "Вы хотите зарегистрироваться как администратор?",
             reply_markup=reply_markup
         )
@@ -163,12 +328,13 @@ async def ask_secret(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ENTER_SECRET
     else:
         # Регистрация как обычный пользователь
-        users_col.insert_one({
+        await users_col.insert_one({
             "name": context.user_data['name'],
             "telegram_id": update.effective_user.id,
             "is_admin": False,
             "amount_paid": 0
         })
+        user_cache.invalidate(update.effective_user.id)
         await update.message.reply_text("Вы успешно зарегистрировались как пользователь.")
         return ConversationHandler.END
 
@@ -176,12 +342,13 @@ async def enter_secret(update: Update, context: ContextTypes.DEFAULT_TYPE):
     secret_phrase = update.message.text
     if secret_phrase in admin_secret_phrases:
         # Регистрация как администратор
-        users_col.insert_one({
+        await users_col.insert_one({
             "name": context.user_data['name'],
             "telegram_id": update.effective_user.id,
             "is_admin": True,
             "amount_paid": 0
         })
+        user_cache.invalidate(update.effective_user.id)
         await update.message.reply_text("Вы успешно зарегистрировались как администратор.")
     else:
         await update.message.reply_text("Неверная секретная фраза. Регистрация не удалась.")
@@ -190,7 +357,7 @@ async def enter_secret(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # Обработчик платежей
 async def payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user = users_col.find_one({"telegram_id": user_id})
+    user = await get_user(user_id)
     if not user:
         await update.message.reply_text("Сначала вам нужно зарегистрироваться, используя /register.")
         return ConversationHandler.END
@@ -214,42 +381,79 @@ async def upload_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return UPLOAD_PHOTO
 
     photo = update.message.photo[-1]
-    file = await photo.get_file()
-    file_path = f"receipts/{update.effective_user.id}_{photo.file_unique_id}.jpg"
-    await file.download_to_drive(custom_path=file_path)
+    if photo.file_size and photo.file_size > MAX_RECEIPT_SIZE:
+        await update.message.reply_text("Файл слишком большой. Пожалуйста, загрузите фотографию меньшего размера.")
+        return UPLOAD_PHOTO
 
-    # Создать запрос на платеж
-    payment_requests_col.insert_one({
+    # Запрос виден администраторам только после сохранения квитанции
+    result = await payment_requests_col.insert_one({
         "telegram_id": update.effective_user.id,
         "amount": context.user_data['amount'],
-        "receipt_path": file_path,
-        "status": "pending"
+        # file_id позволяет показать квитанцию админу без повторной загрузки
+        "receipt_file_id": photo.file_id,
+        "status": "processing",
+        "created_at": datetime.now()
     })
-    await update.message.reply_text("Ваш запрос на платеж отправлен на одобрение.")
+    if not receipt_workers.submit(process_receipt, context.bot, result.inserted_id, update.effective_user.id, photo.file_id):
+        await payment_requests_col.update_one({'_id': result.inserted_id}, {'$set': {'status': 'failed'}})
+        await update.message.reply_text("Сервер перегружен. Пожалуйста, попробуйте позже.")
+        return ConversationHandler.END
+
+    await update.message.reply_text("Квитанция получена и обрабатывается.")
     return ConversationHandler.END
 
+async def process_receipt(bot, request_id, user_id, file_id):
+    """Фоновая загрузка, проверка и сохранение квитанции."""
+    path = receipt_store.temp_path()
+    try:
+        file = await bot.get_file(file_id)
+        if file.file_size and file.file_size > MAX_RECEIPT_SIZE:
+            raise ReceiptError(f"недопустимый размер файла: {file.file_size} байт")
+        await file.download_to_drive(custom_path=path)
+        receipt_hash, seen_before = await receipt_store.save_file(path)
+    except Exception as e:
+        logger.error(f"Не удалось обработать квитанцию запроса {request_id}: {e}")
+        await payment_requests_col.update_one(
+            {'_id': request_id}, {'$set': {'status': 'failed', 'error': str(e)}}
+        )
+        await bot.send_message(
+            user_id, "Не удалось обработать квитанцию. Пожалуйста, отправьте платеж заново через /payment."
+        )
+        return
+    finally:
+        # save_file() переносит файл в хранилище; после ошибки до него временный файл остается
+        if os.path.exists(path):
+            os.unlink(path)
+
+    # Та же квитанция уже прикладывалась к другому запросу
+    duplicate_of = None
+    if seen_before:
+        previous = await payment_requests_col.find_one(
+            {"receipt_hash": receipt_hash, "status": {"$in": ["pending", "approved"]}}, {"_id": 1}
+        )
+        duplicate_of = previous['_id'] if previous else None
+
+    await payment_requests_col.update_one({'_id': request_id}, {'$set': {
+        "receipt_hash": receipt_hash,
+        "duplicate_of": duplicate_of,
+        "status": "pending",
+        "queued_at": datetime.now()
+    }})
+    await bot.send_message(user_id, "Ваш запрос на платеж отправлен на одобрение.")
+
 # Проверка баланса
 async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user = users_col.find_one({"telegram_id": user_id})
+    user = await get_user(user_id)
     if not user:
         await update.message.reply_text("Сначала вам нужно зарегистрироваться, используя /register.")
         return
 
-    # Вычисление количества месяцев с начала периода
-    today = datetime.now()
-    delta = today - payment_start_date
-    months_since_start = delta.days // 30  # Приблизительное количество месяцев
-    months_since_start = months_since_start % 12  # Сброс после 12 месяцев
-
-    total_required_payment = required_payment * (months_since_start + 1)
-
-    amount_paid = user.get('amount_paid', 0)
-    balance_amount = amount_paid - total_required_payment
+    # Баланс считается по накопленной сумме платежей и числу календарных периодов
+    balance_amount = ledger.user_balance(user)
 
     if balance_amount >= 0:
-        next_payment_date = payment_start_date + timedelta(days=30 * (months_since_start + 1))
-        next_payment_date_str = next_payment_date.strftime("%d %B %Y")
+        next_payment_date_str = ledger.next_payment_date(user).strftime("%d %B %Y")
         await update.message.reply_text(
             f"Ваши платежи актуальны!\nСледующий платеж должен быть внесен "
             f"{next_payment_date_str}.\nСпасибо!"
@@ -266,6 +470,7 @@ async def equipment(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("Добавить вещь", callback_data='add_equipment')],
         [InlineKeyboardButton("Просмотр списка имущества", callback_data='view_equipment')],
         [InlineKeyboardButton("Запросить вещь", callback_data='request_equipment')],
+        [InlineKeyboardButton("Вернуть вещь", callback_data='return_equipment')],
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text("Меню взаимодействия с отрядным имуществом:", reply_markup=reply_markup)
@@ -280,15 +485,10 @@ async def equipment_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("Пожалуйста, введите название вещи:")
         return ADD_EQUIPMENT_NAME
     elif action == 'view_equipment':
-        items = list(equipment_col.find())
-        if not items:
-            await query.edit_message_text("Вещь не найдена.")
-        else:
-            equipment_list = "\n".join([f"{item['name']}: {item['description']}" for item in items])
-            await query.edit_message_text(f"Список вещей:\n{equipment_list}")
+        await show_list_page(query, context, 'equipment')
         return ConversationHandler.END
     elif action == 'request_equipment':
-        items = list(equipment_col.find({"available": True}))
+        items = await equipment_col.find({"available": True}, {"name": 1}).to_list(length=None)
         if not items:
             await query.edit_message_text("Нет доступной вещи для запроса.")
             return ConversationHandler.END
@@ -297,6 +497,15 @@ async def equipment_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
         await query.message.reply_text("Пожалуйста, выберите вещь, которую вы хотите запросить:", reply_markup=reply_markup)
         return REQUEST_EQUIPMENT_ITEM
+    elif action == 'return_equipment':
+        items = await equipment_col.find({"holder.telegram_id": query.from_user.id}, {"name": 1}).to_list(length=None)
+        if not items:
+            await query.edit_message_text("У вас нет взятых вещей.")
+            return ConversationHandler.END
+        keyboard = [[KeyboardButton(item['name'])] for item in items]
+        reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
+        await query.message.reply_text("Пожалуйста, выберите вещь, которую вы возвращаете:", reply_markup=reply_markup)
+        return RETURN_EQUIPMENT_ITEM
 
 async def add_equipment_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     name = update.message.text
@@ -309,36 +518,55 @@ async def add_equipment_description(update: Update, context: ContextTypes.DEFAUL
     name = context.user_data.get('equipment_name')
 
     # Добавление оборудования в базу данных
-    equipment_col.insert_one({
-        "name": name,
-        "description": description,
-        "available": True,
-    })
+    try:
+        await equipment_col.insert_one({
+            "name": name,
+            "description": description,
+            "available": True,
+        })
+    except DuplicateKeyError:
+        await update.message.reply_text(f"Вещь '{name}' уже есть в списке.")
+        return ConversationHandler.END
     await update.message.reply_text(f"Вещь '{name}' успешно добавлена.")
     return ConversationHandler.END
 
 async def request_equipment_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
     name = update.message.text
-    item = equipment_col.find_one({"name": name})
-    if not item:
-        await update.message.reply_text("Неверное название вещи.")
-        return ConversationHandler.END
+    user = await get_user(update.effective_user.id)
 
-    if not item.get('available', True):
-        await update.message.reply_text("Эта вещь в настоящее время недоступна.")
+    # Проверка доступности и выдача - одна атомарная операция
+    item = await checkout_item(
+        equipment_col, name, update.effective_user.id, user['name'] if user else None
+    )
+    if not item:
+        if await equipment_col.find_one({"name": name}, {"_id": 1}):
+            await update.message.reply_text("Эта вещь в настоящее время недоступна.")
+        else:
+            await update.message.reply_text("Неверное название вещи.")
         return ConversationHandler.END
 
-    # Отметить оборудование как недоступное
-    equipment_col.update_one({"name": name}, {'$set': {'available': False}})
+    due_date_str = item['due_at'].strftime("%d.%m.%Y")
     await update.message.reply_text(
-        f"Вы запросили '{name}'. Пожалуйста, свяжитесь с администратором для дальнейших инструкций."
+        f"Вы запросили '{name}'. Вернуть нужно до {due_date_str}.\n"
+        "Пожалуйста, свяжитесь с администратором для дальнейших инструкций.",
+        reply_markup=ReplyKeyboardRemove()
     )
     return ConversationHandler.END
 
+async def return_equipment_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    name = update.message.text
+    item = await return_item(equipment_col, name, holder_id=update.effective_user.id)
+    if not item:
+        await update.message.reply_text("Эта вещь не числится за вами.", reply_markup=ReplyKeyboardRemove())
+        return ConversationHandler.END
+
+    await update.message.reply_text(f"Вещь '{name}' возвращена. Спасибо!", reply_markup=ReplyKeyboardRemove())
+    return ConversationHandler.END
+
 # Функции администратора
 async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user = users_col.find_one({"telegram_id": user_id, "is_admin": True})
+    user = await get_admin(user_id)
     if not user:
         await update.message.reply_text("Доступ запрещен. Только для администраторов.")
         return
@@ -346,6 +574,7 @@ async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [InlineKeyboardButton("Управление запросами на регистрацию", callback_data='manage_registrations')],
         [InlineKeyboardButton("Управление запросами на платежи", callback_data='manage_payments')],
+        [InlineKeyboardButton("Пакетная обработка платежей", callback_data='bulk_payments')],
         [InlineKeyboardButton("Список всех зарегистрированных пользователей", callback_data='list_registered')],
         [InlineKeyboardButton("Список всех незарегистрированных пользователей", callback_data='list_unregistered')],
         [InlineKeyboardButton("Уведомить пользователей", callback_data='notify_users')],
@@ -362,6 +591,8 @@ async def admin_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await manage_registrations(query, context)
     elif data == 'manage_payments':
         await manage_payments(query, context)
+    elif data == 'bulk_payments':
+        await show_bulk_payments(query, context)
     elif data == 'list_registered':
         await list_registered_users(query, context)
     elif data == 'list_unregistered':
@@ -371,24 +602,20 @@ async def admin_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # Управление запросами на регистрацию
 async def manage_registrations(query: CallbackQuery, context: ContextTypes.DEFAULT_TYPE):
-    requests = list(registration_requests_col.find({"status": "pending"}))
-    if not requests:
+    request = await registration_queue.current_or_next(query.from_user.id)
+    if not request:
         await query.edit_message_text("Нет ожидающих запросов на регистрацию.")
         return
 
-    context.user_data['registration_requests'] = requests
-    context.user_data['current_request_index'] = 0
-    await show_registration_request(query, context)
+    await show_registration_request(query, context, request)
 
-async def show_registration_request(query, context):
-    index = context.user_data['current_request_index']
-    requests = context.user_data['registration_requests']
-    if index >= len(requests):
+async def show_registration_request(query, context, request=None):
+    if request is None:
+        request = await registration_queue.current_or_next(query.from_user.id)
+    if request is None:
         await query.edit_message_text("Нет больше запросов на регистрацию.")
         return
 
-    request = requests[index]
-
     keyboard = [
         [
             InlineKeyboardButton("Одобрить", callback_data='approve_registration'),
@@ -401,191 +628,535 @@ async def show_registration_request(query, context):
     text = f"Запрос на регистрацию:\nИмя: {request['name']}\nTelegram ID: {request['telegram_id']}"
     await query.edit_message_text(text, reply_markup=reply_markup)
 
+async def approve_registration(request, reviewer_id):
+    """Создает пользователя и закрывает запрос; в наборе реплик - одной транзакцией.
+
+    Пользователь добавляется до смены статуса, поэтому без транзакций сбой
+    между записями оставит запрос в очереди, а не одобренным без пользователя.
+    Если запрос уже обработан другим администратором, пользователь удаляется
+    и возвращается False. DuplicateKeyError означает, что аккаунт уже зарегистрирован.
+    """
+    async def apply(session):
+        result = await users_col.insert_one({
+            "name": request['name'],
+            "telegram_id": request['telegram_id'],
+            "is_admin": False,
+            "amount_paid": 0
+        }, session=session)
+        if await registration_queue.resolve(request['_id'], 'approved', session=session, reviewed_by=reviewer_id):
+            return True
+        await users_col.delete_one({"_id": result.inserted_id}, session=session)
+        return False
+
+    return await database.run_transaction(apply)
+
 async def handle_registration_decision(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     action = query.data
+    reviewer_id = query.from_user.id
 
-    index = context.user_data['current_request_index']
-    requests = context.user_data['registration_requests']
-    if index >= len(requests):
-        await query.edit_message_text("Нет больше запросов на регистрацию.")
+    if action == 'stop_managing_registrations':
+        await registration_queue.release(reviewer_id)
+        await query.edit_message_text("Управление запросами на регистрацию остановлено.")
         return ConversationHandler.END
 
-    request = requests[index]
+    request = await registration_queue.current(reviewer_id)
+    if request is None:
+        # Срок закрепления истек, и запрос забрал другой администратор
+        await query.edit_message_text("Запрос уже обработан другим администратором.")
+        await show_registration_request(query, context)
+        return
+
     user_chat_id = request['telegram_id']
 
     if action == 'approve_registration':
-        users_col.insert_one({
-            "name": request['name'],
-            "telegram_id": request['telegram_id'],
-            "is_admin": False,
-            "amount_paid": 0
-        })
-        registration_requests_col.update_one({'_id': request['_id']}, {'$set': {'status': 'approved'}})
-        await context.bot.send_message(user_chat_id, "Ваша регистрация одобрена.")
-        await query.edit_message_text("Регистрация одобрена.")
-        context.user_data['current_request_index'] += 1
+        try:
+            approved = await approve_registration(request, reviewer_id)
+        except DuplicateKeyError:
+            # Аккаунт уже зарегистрирован: запрос закрывается, чтобы не висеть в очереди
+            await registration_queue.resolve(
+                request['_id'], 'denied', reviewed_by=reviewer_id, reason='already_registered'
+            )
+            await query.edit_message_text(
+                f"Telegram-аккаунт {user_chat_id} уже зарегистрирован, запрос закрыт."
+            )
+        else:
+            if approved:
+                user_cache.invalidate(request['telegram_id'])
+                await context.bot.send_message(user_chat_id, "Ваша регистрация одобрена.")
+                await query.edit_message_text("Регистрация одобрена.")
         await show_registration_request(query, context)
     elif action == 'deny_registration':
-        registration_requests_col.update_one({'_id': request['_id']}, {'$set': {'status': 'denied'}})
-        await context.bot.send_message(user_chat_id, "Ваша регистрация отклонена.")
-        await query.edit_message_text("Регистрация отклонена.")
-        context.user_data['current_request_index'] += 1
+        if await registration_queue.resolve(request['_id'], 'denied', reviewed_by=reviewer_id):
+            await context.bot.send_message(user_chat_id, "Ваша регистрация отклонена.")
+            await query.edit_message_text("Регистрация отклонена.")
         await show_registration_request(query, context)
     elif action == 'postpone_registration':
-        # Переместить в конец списка
-        context.user_data['registration_requests'].append(context.user_data['registration_requests'].pop(index))
+        # Переместить в конец очереди
+        await registration_queue.postpone(request['_id'], reviewer_id)
         await query.edit_message_text("Регистрация отложена.")
         await show_registration_request(query, context)
-    elif action == 'stop_managing_registrations':
-        await query.edit_message_text("Управление запросами на регистрацию остановлено.")
-        return ConversationHandler.END
 
 # Управление запросами на платежи
 async def manage_payments(query: CallbackQuery, context: ContextTypes.DEFAULT_TYPE):
-    requests = list(payment_requests_col.find({"status": "pending"}))
-    if not requests:
+    request = await payment_queue.current_or_next(query.from_user.id)
+    if not request:
         await query.edit_message_text("Нет ожидающих запросов на платежи.")
         return
 
-    context.user_data['payment_requests'] = requests
-    context.user_data['current_payment_index'] = 0
-    await show_payment_request(query, context)
+    await show_payment_request(query, context, request)
+
+async def load_receipt(request):
+    """Миниатюра квитанции; для старых запросов - файл по receipt_path."""
+    if 'receipt_hash' in request:
+        return await receipt_store.read(request['receipt_hash'])
+    with open(request['receipt_path'], 'rb') as photo_file:
+        return photo_file.read()
+
+async def send_receipt(send_photo, request, caption, reply_markup):
+    """Отправляет квитанцию, по возможности по file_id без повторной загрузки байтов.
+
+    Если пришлось загрузить файл, file_id из ответа Telegram сохраняется во
+    всех запросах с тем же receipt_hash, так что одна и та же квитанция
+    загружается не больше одного раза, даже если ее прислали повторно.
+    """
+    for file_id in (request.get('admin_file_id'), request.get('receipt_file_id')):
+        if not file_id:
+            continue
+        try:
+            return await send_photo(photo=file_id, caption=caption, reply_markup=reply_markup)
+        except BadRequest as e:
+            logger.warning(f"file_id квитанции {request['_id']} недействителен: {e}")
+
+    receipt_hash = request.get('receipt_hash')
+    if receipt_hash and not request.get('admin_file_id'):
+        # Та же квитанция могла уже загружаться для другого запроса
+        other = await payment_requests_col.find_one(
+            {"receipt_hash": receipt_hash, "admin_file_id": {"$exists": True}}, {"admin_file_id": 1}
+        )
+        if other:
+            try:
+                return await send_photo(photo=other['admin_file_id'], caption=caption, reply_markup=reply_markup)
+            except BadRequest as e:
+                logger.warning(f"file_id квитанции {receipt_hash} недействителен: {e}")
+
+    sent_message = await send_photo(
+        photo=await load_receipt(request), caption=caption, reply_markup=reply_markup
+    )
+    file_id = sent_message.photo[-1].file_id
+    if receipt_hash:
+        await payment_requests_col.update_many({'receipt_hash': receipt_hash}, {'$set': {'admin_file_id': file_id}})
+    else:
+        await payment_requests_col.update_one({'_id': request['_id']}, {'$set': {'admin_file_id': file_id}})
+    return sent_message
 
-async def show_payment_request(query_or_update, context):
-    index = context.user_data['current_payment_index']
-    requests = context.user_data['payment_requests']
-    if index >= len(requests):
+async def show_payment_request(query_or_update, context, request=None):
+    if request is None:
+        if isinstance(query_or_update, CallbackQuery):
+            reviewer_id = query_or_update.from_user.id
+        else:
+            reviewer_id = query_or_update.effective_user.id
+        request = await payment_queue.current_or_next(reviewer_id)
+    if request is None:
         if isinstance(query_or_update, Update):
-            await query_or_update.message.reply_text("Нет больше запросов на платежи.")
+            await query_or_update.effective_message.reply_text("Нет больше запросов на платежи.")
         else:
             await query_or_update.edit_message_text("Нет больше запросов на платежи.")
         return
 
-    request = requests[index]
-
+    # id запроса в кнопках: нажатие на старом сообщении не затронет следующий запрос
     keyboard = [
         [
-            InlineKeyboardButton("Одобрить", callback_data='approve_payment'),
-            InlineKeyboardButton("Отклонить", callback_data='deny_payment'),
-            InlineKeyboardButton("Отложить", callback_data='postpone_payment'),
+            InlineKeyboardButton("Одобрить", callback_data=f"approve_payment:{request['_id']}"),
+            InlineKeyboardButton("Отклонить", callback_data=f"deny_payment:{request['_id']}"),
+            InlineKeyboardButton("Отложить", callback_data=f"postpone_payment:{request['_id']}"),
         ],
         [InlineKeyboardButton("Прекратить управление", callback_data='stop_managing_payments')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     text = f"Запрос на платеж:\nID пользователя: {request['telegram_id']}\nСумма: {request['amount']}"
 
+    if request.get('duplicate_of'):
+        text += "\n⚠️ Эта квитанция уже прикладывалась к другому запросу."
+
     # Отправка фото квитанции с подписью и инлайн-клавиатурой
     try:
-        with open(request['receipt_path'], 'rb') as photo_file:
-            # Удаляем предыдущее сообщение и отправляем новое
-            if isinstance(query_or_update, CallbackQuery):
-                await query_or_update.message.delete()
-                sent_message = await query_or_update.message.chat.send_photo(
-                    photo=photo_file,
-                    caption=text,
-                    reply_markup=reply_markup
-                )
-                context.user_data['admin_message_id'] = sent_message.message_id
-            elif isinstance(query_or_update, Update):
-                sent_message = await query_or_update.message.reply_photo(
-                    photo=photo_file,
-                    caption=text,
-                    reply_markup=reply_markup
-                )
-                context.user_data['admin_message_id'] = sent_message.message_id
+        # Удаляем предыдущее сообщение и отправляем новое
+        if isinstance(query_or_update, CallbackQuery):
+            await query_or_update.message.delete()
+            sent_message = await send_receipt(
+                query_or_update.message.chat.send_photo, request, text, reply_markup
+            )
+            context.user_data['admin_message_id'] = sent_message.message_id
+        elif isinstance(query_or_update, Update):
+            sent_message = await send_receipt(
+                query_or_update.effective_message.reply_photo, request, text, reply_markup
+            )
+            context.user_data['admin_message_id'] = sent_message.message_id
     except FileNotFoundError:
         if isinstance(query_or_update, CallbackQuery):
             await query_or_update.edit_message_text("Изображение квитанции не найдено.")
         elif isinstance(query_or_update, Update):
-            await query_or_update.message.reply_text("Изображение квитанции не найдено.")
+            await query_or_update.effective_message.reply_text("Изображение квитанции не найдено.")
+
+# Кнопки решения по запросу: действие и id запроса из show_payment_request
+PAYMENT_DECISION_PATTERN = '^((approve_payment|deny_payment|postpone_payment):[0-9a-f]{24}|stop_managing_payments)$'
 
 async def handle_payment_decision(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    action = query.data
+    action, _, request_id = query.data.partition(':')
+    reviewer_id = query.from_user.id
 
-    index = context.user_data['current_payment_index']
-    requests = context.user_data['payment_requests']
-    if index >= len(requests):
-        await context.bot.send_message(chat_id=query.from_user.id, text="Нет больше запросов на платежи.")
+    if action == 'stop_managing_payments':
+        await payment_queue.release(reviewer_id)
+        await context.bot.send_message(chat_id=reviewer_id, text="Управление запросами на платежи остановлено.")
         return ConversationHandler.END
 
-    request = requests[index]
-    user_chat_id = request['telegram_id']
+    # Решение принимается один раз: кнопки этого сообщения больше не нужны
+    try:
+        await query.edit_message_reply_markup(None)
+    except BadRequest as e:
+        logger.debug(f"Не удалось убрать кнопки запроса {request_id}: {e}")
+
+    request = await payment_queue.held(ObjectId(request_id), reviewer_id)
+    if request is None:
+        # Запрос уже решен или срок закрепления истек, и его забрал другой администратор
+        await context.bot.send_message(
+            chat_id=reviewer_id, text="Этот запрос уже обработан или закреплен за другим администратором."
+        )
+        return ConversationHandler.END
 
     if action == 'approve_payment':
-        # Одобрить платеж
-        users_col.update_one(
-            {"telegram_id": request['telegram_id']},
-            {'$inc': {'amount_paid': request['amount']}}
-        )
-        payment_requests_col.update_one({'_id': request['_id']}, {'$set': {'status': 'approved'}})
-        await context.bot.send_message(user_chat_id, "Ваш платеж одобрен.")
-        context.user_data['current_payment_index'] += 1
+        # Одобрить платеж; повторное нажатие уже ничего не изменит
+        await approve_payments([request['_id']], reviewer_id, held=True)
         # Показать следующий запрос
         await show_payment_request(update, context)
     elif action == 'deny_payment':
         # Отклонить платеж и запросить комментарий
-        context.user_data['denied_request'] = request
-        await context.bot.send_message(chat_id=query.from_user.id, text="Пожалуйста, введите комментарий для отказа:")
+        context.user_data['denied_request_id'] = request['_id']
+        await context.bot.send_message(chat_id=reviewer_id, text="Пожалуйста, введите комментарий для отказа:")
         return PAYMENT_DENY_COMMENT
     elif action == 'postpone_payment':
         # Отложить платеж
-        context.user_data['payment_requests'].append(context.user_data['payment_requests'].pop(index))
-        await context.bot.send_message(chat_id=query.from_user.id, text="Платеж отложен.")
+        await payment_queue.postpone(request['_id'], reviewer_id)
+        await context.bot.send_message(chat_id=reviewer_id, text="Платеж отложен.")
         # Показать следующий запрос
         await show_payment_request(update, context)
-    elif action == 'stop_managing_payments':
-        await context.bot.send_message(chat_id=query.from_user.id, text="Управление запросами на платежи остановлено.")
-        return ConversationHandler.END
 
 async def handle_payment_denial_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     comment = update.message.text
-    request = context.user_data['denied_request']
-    user_chat_id = request['telegram_id']
-
-    # Обновить статус запроса на платеж и добавить комментарий
-    payment_requests_col.update_one(
-        {'_id': request['_id']},
-        {'$set': {'status': 'denied', 'comment': comment}}
-    )
+    request = await payment_requests_col.find_one({'_id': context.user_data.pop('denied_request_id', None)})
+    if not request:
+        await update.message.reply_text("Запрос на платеж не найден.")
+        return ConversationHandler.END
 
-    # Уведомить пользователя
-    await context.bot.send_message(
-        user_chat_id,
-        f"Ваш платеж отклонен. Комментарий от администратора: {comment}"
-    )
+    # Обновить статус запроса на платеж, добавить комментарий и поставить уведомление пользователю
+    if not await deny_payments([request['_id']], update.effective_user.id, comment, held=True):
+        await update.message.reply_text("Запрос уже обработан другим администратором.")
+        await show_payment_request(update, context)
+        return ConversationHandler.END
 
     await update.message.reply_text("Платеж отклонен, и пользователь уведомлен с вашим комментарием.")
-    context.user_data['current_payment_index'] += 1
 
     # Продолжить с следующим запросом
     await show_payment_request(update, context)
     return ConversationHandler.END
 
-# Список зарегистрированных пользователей
-async def list_registered_users(query: CallbackQuery, context: ContextTypes.DEFAULT_TYPE):
-    users = list(users_col.find())
-    if not users:
-        await query.edit_message_text("Зарегистрированных пользователей не найдено.")
+# Пакетная обработка платежей: список ожидающих запросов с отметками
+BULK_REVIEW_SIZE = getattr(config, 'BULK_REVIEW_SIZE', 20)
+
+async def load_bulk_payments(reviewer_id):
+    """Первые в очереди запросы, не закрепленные за другими администраторами, и имена плательщиков."""
+    now = datetime.now()
+    requests = await payment_requests_col.find(
+        {
+            "status": "pending",
+            "$or": [{"claimed_by": None}, {"claimed_by": reviewer_id}, {"lease_until": {"$lte": now}}],
+        },
+        {"telegram_id": 1, "amount": 1, "duplicate_of": 1},
+    ).sort([("queued_at", 1), ("_id", 1)]).limit(BULK_REVIEW_SIZE).to_list(None)
+
+    names = {}
+    if requests:
+        async for user in users_col.find(
+            {"telegram_id": {"$in": [request['telegram_id'] for request in requests]}},
+            {"telegram_id": 1, "name": 1},
+        ):
+            names[user['telegram_id']] = user['name']
+    return requests, names
+
+async def show_bulk_payments(query: CallbackQuery, context: ContextTypes.DEFAULT_TYPE):
+    requests, names = await load_bulk_payments(query.from_user.id)
+    if not requests:
+        context.user_data.pop('bulk_payments', None)
+        context.user_data.pop('bulk_selected', None)
+        await query.edit_message_text("Нет ожидающих запросов на платежи.")
         return
 
-    user_list = "\n".join([user['name'] for user in users])
-    await query.edit_message_text(f"Зарегистрированные пользователи:\n{user_list}")
+    shown = [str(request['_id']) for request in requests]
+    selected = [request_id for request_id in context.user_data.get('bulk_selected', []) if request_id in shown]
+    context.user_data['bulk_payments'] = shown
+    context.user_data['bulk_selected'] = selected
+
+    keyboard = []
+    for request in requests:
+        mark = "☑" if str(request['_id']) in selected else "☐"
+        warning = " ⚠️" if request.get('duplicate_of') else ""
+        name = names.get(request['telegram_id'], request['telegram_id'])
+        keyboard.append([InlineKeyboardButton(
+            f"{mark} {name} — {request['amount']}{warning}", callback_data=f"bulk:toggle:{request['_id']}"
+        )])
+    keyboard.append([
+        InlineKeyboardButton("Выбрать все", callback_data='bulk:all'),
+        InlineKeyboardButton("Снять выбор", callback_data='bulk:none'),
+    ])
+    keyboard.append([
+        InlineKeyboardButton(f"Одобрить ({len(selected)})", callback_data='bulk:approve'),
+        InlineKeyboardButton(f"Отклонить ({len(selected)})", callback_data='bulk:deny'),
+    ])
+    keyboard.append([InlineKeyboardButton("Закрыть", callback_data='bulk:close')])
+    try:
+        await query.edit_message_text(
+            f"Ожидающие платежи ({len(requests)}). Отметьте запросы и выберите действие.\n"
+            "⚠️ - квитанция уже прикладывалась к другому запросу.",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+        )
+    except BadRequest as e:
+        # Список и отметки не изменились с прошлого показа
+        if "not modified" not in str(e):
+            raise
+
+def payment_approved_message(request):
+    """Уведомление об одобрении; ключ по id запроса не дает отправить его дважды."""
+    return request['telegram_id'], "Ваш платеж одобрен.", f"payment:{request['_id']}"
+
+async def approve_payments(request_ids, reviewer_id, held=False):
+    """Одобряет запросы одним обновлением статусов и одним bulk_write на журнал и балансы.
+
+    Баланс меняется только для запросов, которые этот вызов перевел из
+    pending в approved, поэтому повторное нажатие ничего не изменит.
+    С held=True одобряются только запросы, закрепленные за reviewer_id.
+    Уведомления пишутся в outbox; где доступны транзакции, все изменения
+    применяются атомарно. Возвращает одобренные этим вызовом запросы.
+    """
+    async def apply(session):
+        approved = await payment_queue.resolve_many(
+            request_ids, 'approved', session=session, held_by=reviewer_id if held else None, reviewed_by=reviewer_id
+        )
+        await ledger.record_payments(database, approved, session=session)
+        await outbox.add_many([payment_approved_message(request) for request in approved], session=session)
+        return approved
+
+    approved = await database.run_transaction(apply)
+    outbox.notify()
+    for request in approved:
+        user_cache.invalidate(request['telegram_id'])
+    return approved
+
+async def deny_payments(request_ids, reviewer_id, comment, held=False):
+    """Отклоняет запросы и ставит уведомления с комментарием в outbox. Возвращает отклоненные."""
+    async def apply(session):
+        denied = await payment_queue.resolve_many(
+            request_ids, 'denied', session=session, held_by=reviewer_id if held else None,
+            comment=comment, reviewed_by=reviewer_id,
+        )
+        await outbox.add_many([
+            (
+                request['telegram_id'],
+                f"Ваш платеж отклонен. Комментарий от администратора: {comment}",
+                f"payment:{request['_id']}",
+            )
+            for request in denied
+        ], session=session)
+        return denied
+
+    denied = await database.run_transaction(apply)
+    outbox.notify()
+    return denied
+
+async def bulk_payment_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    reviewer_id = query.from_user.id
+    if not await get_admin(reviewer_id):
+        await query.answer()
+        return ConversationHandler.END
 
-# Список незарегистрированных пользователей
-async def list_unregistered_users(query: CallbackQuery, context: ContextTypes.DEFAULT_TYPE):
-    registered_names = [user['name'] for user in users_col.find()]
-    unregistered_names = [name for name in club_member_names if name not in registered_names]
+    _, action, *args = query.data.split(':')
+    selected = context.user_data.get('bulk_selected', [])
+    if action in ('approve', 'deny') and not selected:
+        await query.answer("Ничего не выбрано")
+        return ConversationHandler.END
+    await query.answer()
 
-    if not unregistered_names:
-        await query.edit_message_text("Все члены клуба зарегистрированы.")
+    if action == 'close':
+        context.user_data.pop('bulk_payments', None)
+        context.user_data.pop('bulk_selected', None)
+        await query.edit_message_text("Пакетная обработка платежей завершена.")
+        return ConversationHandler.END
+    elif action == 'toggle':
+        request_id = args[0]
+        selected = [i for i in selected if i != request_id] if request_id in selected else selected + [request_id]
+    elif action in ('all', 'none'):
+        new_selection = list(context.user_data.get('bulk_payments', [])) if action == 'all' else []
+        if set(new_selection) == set(selected):
+            # Сообщение не изменится, а Telegram отклоняет такое редактирование
+            return ConversationHandler.END
+        selected = new_selection
+    elif action == 'approve':
+        approved = await approve_payments([ObjectId(request_id) for request_id in selected], reviewer_id)
+        await query.message.reply_text(f"Одобрено платежей: {len(approved)} из {len(selected)}.")
+        selected = []
+    elif action == 'deny':
+        await query.message.reply_text(
+            f"Пожалуйста, введите комментарий для отказа по выбранным платежам ({len(selected)}):"
+        )
+        return BULK_DENY_COMMENT
+
+    context.user_data['bulk_selected'] = selected
+    await show_bulk_payments(query, context)
+    return ConversationHandler.END
+
+async def bulk_deny_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    comment = update.message.text
+    selected = context.user_data.pop('bulk_selected', [])
+    denied = await deny_payments(
+        [ObjectId(request_id) for request_id in selected], update.effective_user.id, comment
+    )
+    await update.message.reply_text(
+        f"Отклонено платежей: {len(denied)} из {len(selected)}. Пользователи уведомлены с вашим комментарием."
+    )
+    return ConversationHandler.END
+
+# Постраничные списки: заголовок и сообщение для пустого списка
+LIST_TITLES = {
+    'registered': ("Зарегистрированные пользователи:", "Зарегистрированных пользователей не найдено."),
+    'unregistered': ("Незарегистрированные члены клуба:", "Все члены клуба зарегистрированы."),
+    'equipment': ("Список вещей:", "Вещь не найдена."),
+}
+
+# Списки, доступные только администраторам
+ADMIN_LISTS = {'registered', 'unregistered'}
+
+# Максимальная длина имени и описания вещи в строке списка
+MAX_NAME_LENGTH = 100
+MAX_DESCRIPTION_LENGTH = 200
+# Ограничение Telegram на длину текста сообщения
+MAX_MESSAGE_LENGTH = 4096
+
+def shorten(text, limit):
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+async def unregistered_names():
+    # distinct возвращает только имена и обслуживается индексом по name
+    registered_names = await users_col.distinct("name")
+    return roster_provider.roster.unregistered(registered_names)
+
+async def load_list_page(kind, after=None, before=None):
+    if kind == 'registered':
+        page = await fetch_page(users_col, {}, ['name', '_id'], {"name": 1}, after, before)
+        lines = [shorten(user['name'], MAX_NAME_LENGTH) for user in page.items]
+    elif kind == 'unregistered':
+        page = page_from_sorted(await unregistered_names(), after, before)
+        lines = [shorten(name, MAX_NAME_LENGTH) for name in page.items]
+    else:
+        page = await fetch_page(equipment_col, {}, ['name'], {"name": 1, "description": 1}, after, before)
+        lines = [
+            f"{shorten(item['name'], MAX_NAME_LENGTH)}: {shorten(item.get('description', ''), MAX_DESCRIPTION_LENGTH)}"
+            for item in page.items
+        ]
+    return page, lines
+
+def fit_page(page, lines, title, backwards):
+    """Оставляет столько строк, сколько помещается в одно сообщение.
+
+    Строки отбрасываются с дальнего от границы края страницы: при переходе
+    назад - с начала, иначе - с конца. Кнопки строятся по оставшимся
+    строкам, поэтому отброшенные попадут на соседнюю страницу.
+    """
+    length = len(title)
+    count = 0
+    for line in (reversed(lines) if backwards else lines):
+        length += len(line) + 1
+        if length > MAX_MESSAGE_LENGTH:
+            break
+        count += 1
+    if count == len(lines):
+        return page.items, lines, page.has_prev, page.has_next
+    if backwards:
+        return page.items[-count:], lines[-count:], True, page.has_next
+    return page.items[:count], lines[:count], page.has_prev, True
+
+# Границы страниц хранятся в самих кнопках, чтобы старое сообщение со списком
+# листалось от своих строк: id документа или позиция имени в списке клуба
+def page_token(kind, item):
+    if kind == 'unregistered':
+        return str(roster_provider.roster.position(item))
+    return str(item['_id'])
+
+async def page_bound(kind, token):
+    """Ключ сортировки строки по токену из кнопки или None, если строки больше нет."""
+    if kind == 'unregistered':
+        names = roster_provider.roster.names
+        index = int(token)
+        return [names[index]] if index < len(names) else None
+    collection = users_col if kind == 'registered' else equipment_col
+    doc = await collection.find_one({"_id": ObjectId(token)}, {"name": 1})
+    if doc is None:
+        return None
+    return [doc['name'], doc['_id']] if kind == 'registered' else [doc['name']]
+
+async def show_list_page(query: CallbackQuery, context: ContextTypes.DEFAULT_TYPE, kind, after=None, before=None):
+    title, empty_text = LIST_TITLES[kind]
+    page, lines = await load_list_page(kind, after, before)
+    if not lines:
+        if after is None and before is None:
+            await query.edit_message_text(empty_text)
+        else:
+            # Список изменился между нажатиями - начинаем сначала
+            await show_list_page(query, context, kind)
+        return
+
+    items, lines, has_prev, has_next = fit_page(page, lines, title, backwards=before is not None)
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton(
+            "◀ Назад", callback_data=f'page:{kind}:prev:{page_token(kind, items[0])}'
+        ))
+    if has_next:
+        buttons.append(InlineKeyboardButton(
+            "Далее ▶", callback_data=f'page:{kind}:next:{page_token(kind, items[-1])}'
+        ))
+    reply_markup = InlineKeyboardMarkup([buttons]) if buttons else None
+
+    text = title + "\n" + "\n".join(lines)
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+async def list_page_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    _, kind, direction, token = query.data.split(':')
+
+    if kind in ADMIN_LISTS and not await get_admin(query.from_user.id):
         return
 
-    user_list = "\n".join(unregistered_names)
-    await query.edit_message_text(f"Незарегистрированные члены клуба:\n{user_list}")
+    bound = await page_bound(kind, token)
+    if bound is None:
+        # Строка, от которой листали, удалена - начинаем сначала
+        await show_list_page(query, context, kind)
+    elif direction == 'next':
+        await show_list_page(query, context, kind, after=bound)
+    else:
+        await show_list_page(query, context, kind, before=bound)
+
+# Список зарегистрированных пользователей
+async def list_registered_users(query: CallbackQuery, context: ContextTypes.DEFAULT_TYPE):
+    await show_list_page(query, context, 'registered')
+
+# Список незарегистрированных пользователей
+async def list_unregistered_users(query: CallbackQuery, context: ContextTypes.DEFAULT_TYPE):
+    await show_list_page(query, context, 'unregistered')
 
 # Уведомление пользователей
 async def notify_users_start(query: CallbackQuery, context: ContextTypes.DEFAULT_TYPE):
@@ -618,36 +1189,281 @@ async def notify_users_message(update: Update, context: ContextTypes.DEFAULT_TYP
     category = context.user_data.get('notify_category')
 
     if category == 'notify_all':
-        users = users_col.find()
+        users = users_col.find({}, {"telegram_id": 1})
     elif category == 'notify_debtors':
-        # Пользователи, у которых сумма оплаты меньше требуемой
-        users = users_col.find({"amount_paid": {"$lt": required_payment}})
+        # Пользователи с долгом по тому же расчету, что и /balance
+        users = users_col.find(ledger.debtors_filter(), {"telegram_id": 1})
     elif category == 'notify_not_debtors':
-        users = users_col.find({"amount_paid": {"$gte": required_payment}})
+        users = users_col.find(ledger.not_debtors_filter(), {"telegram_id": 1})
     else:
         await update.message.reply_text("Неверная категория.")
         return ConversationHandler.END
 
-    user_ids = [user['telegram_id'] for user in users]
-    for user_id in user_ids:
-        try:
-            await context.bot.send_message(chat_id=user_id, text=message)
-        except Exception as e:
-            logger.error(f"Не удалось отправить сообщение пользователю {user_id}: {e}")
+    user_ids = [user['telegram_id'] async for user in users]
 
-    await update.message.reply_text("Уведомление отправлено.")
+    # Рассылка идет в фоне, отчет о ходе и итоге придет администратору
+    context.application.create_task(
+        broadcast(context.bot, user_ids, message, report_chat_id=update.effective_chat.id),
+        update=update,
+    )
+    await update.message.reply_text(f"Рассылка запущена для {len(user_ids)} пользователей.")
     return ConversationHandler.END
 
-# Главная функция
-def main():
+# Диагностика индексов: показывает планы выполнения горячих запросов
+async def indexes_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = await get_admin(update.effective_user.id)
+    if not user:
+        await update.message.reply_text("Доступ запрещен. Только для администраторов.")
+        return
+
+    lines = []
+    for title, stages in await database.explain_hot_queries():
+        marker = "⚠️" if "COLLSCAN" in stages else "✅"
+        lines.append(f"{marker} {title}: {' → '.join(stages)}")
+    await update.message.reply_text("Планы запросов:\n" + "\n".join(lines))
+
+# Статистика кэша пользователей
+async def cache_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await get_admin(update.effective_user.id):
+        await update.message.reply_text("Доступ запрещен. Только для администраторов.")
+        return
+
+    stats = user_cache.stats()
+    await update.message.reply_text(
+        f"Кэш пользователей:\nЗаписей: {stats['size']}\n"
+        f"Попаданий: {stats['hits']}\nПромахов: {stats['misses']}\n"
+        f"Доля попаданий: {stats['hit_rate']:.1%}"
+    )
+
+# Сводка по задержкам обработчиков и запросов к базе
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await get_admin(update.effective_user.id):
+        await update.message.reply_text("Доступ запрещен. Только для администраторов.")
+        return
+
+    lines = ["Обработчики (вызовов, среднее, p99):"]
+    for labels, count, avg, p99 in summary("bot_handler_duration_seconds"):
+        lines.append(f"{dict(labels)['handler']}: {count}, {avg * 1000:.0f} мс, ≤{p99 * 1000:.0f} мс")
+    lines.append("\nЗапросы к базе (вызовов, среднее, p99):")
+    for labels, count, avg, p99 in summary("bot_db_operation_duration_seconds"):
+        labels = dict(labels)
+        lines.append(
+            f"{labels['collection']}.{labels['operation']}: {count}, {avg * 1000:.0f} мс, ≤{p99 * 1000:.0f} мс"
+        )
+    stats = user_cache.stats()
+    lines.append(f"\nКэш пользователей: {stats['hit_rate']:.1%} попаданий, {stats['size']} записей")
+    await update.message.reply_text("\n".join(lines))
+
+# Недавно отправленные отчеты: file_id документа по формату
+report_cache = TTLCache(maxsize=len(reports.FORMATS), ttl=getattr(config, 'REPORT_CACHE_TTL', 300))
+
+# Финансовый отчет: /report или /report xlsx
+async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await get_admin(update.effective_user.id):
+        await update.message.reply_text("Доступ запрещен. Только для администраторов.")
+        return
+
+    report_format = context.args[0].lower() if context.args else 'csv'
+    if report_format not in reports.FORMATS:
+        await update.message.reply_text(f"Доступные форматы: {', '.join(reports.FORMATS)}")
+        return
+
+    # Повторный запрос в течение REPORT_CACHE_TTL отправляет уже загруженный файл
+    file_id = report_cache.get(report_format)
+    if file_id is not MISSING:
+        await update.message.reply_document(document=file_id, caption="Финансовый отчет (из кэша)")
+        return
+
+    file, filename = await reports.build_report(database, report_format)
+    with file:
+        sent_message = await update.message.reply_document(
+            document=file, filename=filename, caption="Финансовый отчет"
+        )
+    report_cache.set(report_format, sent_message.document.file_id)
+
+# Периодическая очистка старых квитанций
+async def collect_receipts_job(context: ContextTypes.DEFAULT_TYPE):
+    removed = await receipt_store.collect_garbage(payment_requests_col)
+    if removed:
+        logger.info(f"Удалено старых квитанций: {removed}")
+
+# Номер рабочего процесса (--worker-index); фоновые задачи, которые должны
+# выполняться в одном экземпляре, запускает только процесс с номером 0
+worker_index = 0
+
+# Подготовка ресурсов при запуске бота
+async def on_startup(application):
+    global metrics_server, receipt_store, outbox_worker, resubmit_task
+    started = time.perf_counter()
+    # Независимые шаги подготовки идут параллельно: индексы в MongoDB,
+    # чтение списка клуба и каталог квитанций на диске
+    loop = asyncio.get_running_loop()
+    singletons = worker_index == 0
+    reminders_enabled = (
+        singletons and application.job_queue is not None and getattr(config, 'DEBT_REMINDERS_ENABLED', True)
+    )
+    receipt_store, *_ = await asyncio.wait_for(asyncio.gather(
+        loop.run_in_executor(None, create_receipt_store, database),
+        roster_provider.load(),
+        database.ensure_indexes(),
+        outbox.ensure_indexes(),
+        debt_reminders.ensure_indexes() if reminders_enabled else asyncio.sleep(0),
+    ), STARTUP_TIMEOUT)
+    logger.info(f"Ресурсы подготовлены за {time.perf_counter() - started:.2f} с")
+    if singletons:
+        await reconcile_payments()
+
+    receipt_workers.start()
+    outbox_worker = OutboxWorker(outbox, application.bot)
+    outbox_worker.start()
+    if not singletons:
+        logger.info(f"Рабочий процесс {worker_index}: фоновые задачи выполняет процесс 0")
+    else:
+        # Квитанции, обработка которых прервалась (остановка или переполненная очередь)
+        resubmit_task = asyncio.create_task(watch_stale_receipts(application.bot))
+        if application.job_queue is not None:
+            application.job_queue.run_repeating(
+                collect_receipts_job, interval=timedelta(days=1), first=timedelta(minutes=5)
+            )
+            if reminders_enabled:
+                schedule_debt_reminders(application.job_queue, debt_reminders)
+        else:
+            logger.warning(
+                "JobQueue недоступна (нужен python-telegram-bot[job-queue]), "
+                "очистка квитанций и напоминания о долге отключены"
+            )
+    roster_provider.start(getattr(config, 'NAMES_RELOAD_INTERVAL', 30))
+    metrics_port = getattr(config, 'METRICS_PORT', None)
+    if metrics_port:
+        # У каждого рабочего процесса свой порт: METRICS_PORT + номер процесса
+        metrics_port += worker_index
+        metrics_server = start_metrics_server(metrics_port, getattr(config, 'METRICS_LISTEN', '127.0.0.1'))
+
+# За сколько дней проверять одобренные платежи без записи в журнале
+RECONCILE_DAYS = getattr(config, 'PAYMENT_RECONCILE_DAYS', 7)
+
+async def reconcile_payments():
+    """Досписывает в журнал и на балансы платежи, одобрение которых прервалось сбоем.
+
+    Нужно только без транзакций: в наборе реплик смена статуса, запись в
+    журнал и уведомление фиксируются вместе.
+    """
+    if await database.supports_transactions():
+        return
+    # Записи журнала, зачисление которых на баланс прервалось
+    for entry in await ledger.apply_pending_entries(database):
+        user_cache.invalidate(entry['telegram_id'])
+        logger.warning(f"Дозачислен платеж по запросу {entry['payment_request_id']}")
+
+    missed = await ledger.unrecorded_payments(database, RECONCILE_DAYS)
+    if not missed:
+        return
+    # Несколько процессов могут восстанавливать одни и те же платежи одновременно:
+    # уведомляем только о записях, вставленных этим вызовом
+    recorded = await ledger.record_payments(database, missed)
+    await outbox.add_many([payment_approved_message(request) for request in recorded])
+    for request in missed:
+        user_cache.invalidate(request['telegram_id'])
+    logger.warning(f"Восстановлены записи журнала для одобренных платежей: {len(recorded)}")
+
+# Квитанции старше этого (секунды) в статусе processing считаются брошенными
+RECEIPT_STALE_SECONDS = getattr(config, 'RECEIPT_STALE_SECONDS', 300)
+# Фоновая повторная постановка брошенных квитанций в очередь
+resubmit_task = None
+
+async def resubmit_receipts(bot):
+    """Ставит в очередь брошенные квитанции, дожидаясь места, если очередь заполнена.
+
+    Свежие запросы пропускаются: их может прямо сейчас обрабатывать
+    этот или другой процесс. Запрос перед постановкой помечается
+    resubmitted_at, чтобы его не взяли повторно раньше, чем через
+    RECEIPT_STALE_SECONDS.
+    """
+    stale_before = datetime.now() - timedelta(seconds=RECEIPT_STALE_SECONDS)
+    stale = {
+        "status": "processing",
+        "created_at": {"$lt": stale_before},
+        "$or": [{"resubmitted_at": None}, {"resubmitted_at": {"$lt": stale_before}}],
+    }
+    async for request in payment_requests_col.find(stale, {"telegram_id": 1, "receipt_file_id": 1}):
+        claimed = await payment_requests_col.update_one(
+            {"_id": request['_id'], **stale}, {"$set": {"resubmitted_at": datetime.now()}}
+        )
+        if claimed.modified_count:
+            await receipt_workers.put(
+                process_receipt, bot, request['_id'], request['telegram_id'], request['receipt_file_id']
+            )
+
+async def watch_stale_receipts(bot):
+    while True:
+        try:
+            await resubmit_receipts(bot)
+        except Exception as e:
+            logger.error(f"Не удалось переотправить квитанции в обработку: {e}")
+        await asyncio.sleep(RECEIPT_STALE_SECONDS)
+
+# Освобождение ресурсов при остановке бота
+async def on_stop(application):
+    # Фоновым задачам еще нужен бот, поэтому дожидаемся их до его остановки
+    if resubmit_task is not None:
+        resubmit_task.cancel()
+    await receipt_workers.stop()
+    if outbox_worker is not None:
+        await outbox_worker.stop()
+
+async def on_shutdown(application):
+    roster_provider.stop()
+    if metrics_server is not None:
+        metrics_server.stop()
+    database.close()
+
+# Параметры запуска: один процесс, прием вебхуков или рабочий процесс
+def parse_args():
+    parser = argparse.ArgumentParser(description="Карамельный Бот")
+    parser.add_argument(
+        '--role', choices=['standalone', 'ingress', 'worker'],
+        default=getattr(config, 'BOT_ROLE', 'standalone'),
+        help="standalone - все в одном процессе; ingress - прием вебхуков в общую очередь; "
+             "worker - обработка своей части общей очереди",
+    )
+    parser.add_argument('--worker-index', type=int, default=getattr(config, 'WORKER_INDEX', 0))
+    parser.add_argument('--workers', type=int, default=getattr(config, 'WORKER_COUNT', 1))
+    return parser.parse_args()
+
+# Создание приложения со всеми обработчиками
+def build_application(with_updater=True):
+    create_resources()
     # Создайте приложение и передайте токен вашего бота
-    app = ApplicationBuilder().token(config.TOKEN).build()
+    builder = (
+        ApplicationBuilder()
+        .token(config.TOKEN)
+        .persistence(MongoPersistence(database))
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+    )
+    # Другой адрес Bot API, например локальный сервер или имитация для нагрузочных тестов
+    bot_api_url = getattr(config, 'BOT_API_BASE_URL', None)
+    if bot_api_url:
+        builder = builder.base_url(f"{bot_api_url}/bot").base_file_url(f"{bot_api_url}/file/bot")
+    if not with_updater:
+        # Обновления приходят из общей очереди, а не от Telegram напрямую
+        builder = builder.updater(None)
+    app = builder.build()
+
+    # Повторные и слишком частые обновления отбрасываются до всех обработчиков
+    add_update_guard(app)
 
     # Обработчик разговоров для регистрации пользователя
     registration_conv = ConversationHandler(
+        name='registration_conv',
+        persistent=True,
         entry_points=[CommandHandler('register', register)],
         states={
-            CHOOSING_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_name)],
+            CHOOSING_NAME: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, choose_name),
+                CallbackQueryHandler(pick_name, pattern='^(pick_name|pick_page):[0-9]+:[0-9]+$'),
+            ],
             ASK_SECRET: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_secret)],
             ENTER_SECRET: [MessageHandler(filters.TEXT & ~filters.COMMAND, enter_secret)],
         },
@@ -656,6 +1472,8 @@ def main():
 
     # Обработчик разговоров для запросов на платеж
     payment_conv = ConversationHandler(
+        name='payment_conv',
+        persistent=True,
         entry_points=[CommandHandler('payment', payment)],
         states={
             PAYMENT_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, payment_amount)],
@@ -666,18 +1484,23 @@ def main():
 
     # Обработчик разговоров для управления оборудованием
     equipment_conv = ConversationHandler(
+        name='equipment_conv',
+        persistent=True,
         entry_points=[CommandHandler('equipment', equipment)],
         states={
-            EQUIPMENT_ACTION: [CallbackQueryHandler(equipment_menu, pattern='^(add_equipment|view_equipment|request_equipment)$')],
+            EQUIPMENT_ACTION: [CallbackQueryHandler(equipment_menu, pattern='^(add_equipment|view_equipment|request_equipment|return_equipment)$')],
             ADD_EQUIPMENT_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_equipment_name)],
             ADD_EQUIPMENT_DESCRIPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_equipment_description)],
             REQUEST_EQUIPMENT_ITEM: [MessageHandler(filters.TEXT & ~filters.COMMAND, request_equipment_item)],
+            RETURN_EQUIPMENT_ITEM: [MessageHandler(filters.TEXT & ~filters.COMMAND, return_equipment_item)],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
     )
 
     # Обработчик разговоров для управления регистрациями
     registration_management_conv = ConversationHandler(
+        name='registration_management_conv',
+        persistent=True,
         entry_points=[CallbackQueryHandler(handle_registration_decision, pattern='^(approve_registration|deny_registration|postpone_registration|stop_managing_registrations)$')],
         states={},
         fallbacks=[CommandHandler('cancel', cancel)],
@@ -688,7 +1511,9 @@ def main():
 
     # Обработчик разговоров для управления платежами
     payment_management_conv = ConversationHandler(
-        entry_points=[CallbackQueryHandler(handle_payment_decision, pattern='^(approve_payment|deny_payment|postpone_payment|stop_managing_payments)$')],
+        name='payment_management_conv',
+        persistent=True,
+        entry_points=[CallbackQueryHandler(handle_payment_decision, pattern=PAYMENT_DECISION_PATTERN)],
         states={
             PAYMENT_DENY_COMMENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_payment_denial_comment)],
         },
@@ -698,8 +1523,24 @@ def main():
         per_message=False,
     )
 
+    # Обработчик разговоров для пакетной обработки платежей
+    bulk_payment_conv = ConversationHandler(
+        name='bulk_payment_conv',
+        persistent=True,
+        entry_points=[CallbackQueryHandler(bulk_payment_button, pattern='^bulk:')],
+        states={
+            BULK_DENY_COMMENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, bulk_deny_comment)],
+        },
+        fallbacks=[CommandHandler('cancel', cancel)],
+        per_user=True,
+        per_chat=True,
+        per_message=False,
+    )
+
     # Обработчик разговоров для уведомлений
     notify_conv = ConversationHandler(
+        name='notify_conv',
+        persistent=True,
         entry_points=[CallbackQueryHandler(notify_users_category_selected, pattern='^(notify_all|notify_debtors|notify_not_debtors|notify_cancel)$')],
         states={
             NOTIFY_MESSAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, notify_users_message)],
@@ -716,6 +1557,10 @@ def main():
     app.add_handler(CommandHandler('help', help_command))
     app.add_handler(CommandHandler('balance', balance))
     app.add_handler(CommandHandler('admin', admin_menu))
+    app.add_handler(CommandHandler('indexes', indexes_command))
+    app.add_handler(CommandHandler('cachestats', cache_stats_command))
+    app.add_handler(CommandHandler('stats', stats_command))
+    app.add_handler(CommandHandler('report', report_command))
     app.add_handler(CommandHandler('cancel', cancel))
 
     # Добавьте обработчики разговоров
@@ -723,21 +1568,59 @@ def main():
     app.add_handler(payment_conv)
     app.add_handler(equipment_conv)
     app.add_handler(payment_management_conv)
+    app.add_handler(bulk_payment_conv)
     app.add_handler(registration_management_conv)
     app.add_handler(notify_conv)
 
     # Добавьте обработчики CallbackQuery
-    app.add_handler(CallbackQueryHandler(admin_button, pattern='^(manage_registrations|manage_payments|list_registered|list_unregistered|notify_users)$'))
+    app.add_handler(CallbackQueryHandler(admin_button, pattern='^(manage_registrations|manage_payments|bulk_payments|list_registered|list_unregistered|notify_users)$'))
     app.add_handler(CallbackQueryHandler(handle_registration_decision, pattern='^(approve_registration|deny_registration|postpone_registration|stop_managing_registrations)$'))
-    app.add_handler(CallbackQueryHandler(handle_payment_decision, pattern='^(approve_payment|deny_payment|postpone_payment|stop_managing_payments)$'))
+    app.add_handler(CallbackQueryHandler(handle_payment_decision, pattern=PAYMENT_DECISION_PATTERN))
+    app.add_handler(CallbackQueryHandler(bulk_payment_button, pattern='^bulk:'))
     app.add_handler(CallbackQueryHandler(notify_users_category_selected, pattern='^(notify_all|notify_debtors|notify_not_debtors|notify_cancel)$'))
-    app.add_handler(CallbackQueryHandler(equipment_menu, pattern='^(add_equipment|view_equipment|request_equipment)$'))
+    app.add_handler(CallbackQueryHandler(equipment_menu, pattern='^(add_equipment|view_equipment|request_equipment|return_equipment)$'))
+    app.add_handler(CallbackQueryHandler(list_page_button, pattern='^page:(registered|unregistered|equipment):(prev|next):[0-9a-f]+$'))
 
     # Обработчик неизвестных команд должен быть добавлен последним
     app.add_handler(MessageHandler(filters.COMMAND, unknown_command))
 
-    # Запуск бота
-    app.run_polling()
+    # Замер времени и ошибок всех обработчиков
+    instrument_application(app)
+    return app
+
+# Настройка рабочего процесса: один из worker_count над общей очередью
+def configure_worker(index, worker_count):
+    global worker_index, user_cache_enabled
+    worker_index = index
+    if worker_count > 1:
+        # Одобрение платежа в одном процессе не сбросит кэш в процессе,
+        # который обслуживает раздел пользователя
+        user_cache_enabled = False
+        # Каждый процесс отправляет уведомления и рассылки сам, а лимит
+        # Telegram общий на бота
+        share_global_rate(worker_count)
+
+# Главная функция
+def main():
+    args = parse_args()
+    if args.role == 'ingress':
+        create_resources()
+        asyncio.run(run_ingress(shared_update_queue))
+        return
+
+    if args.role == 'worker':
+        configure_worker(args.worker_index, args.workers)
+    app = build_application(with_updater=args.role != 'worker')
+
+    # Запуск бота: рабочий процесс, вебхук за обратным прокси или long polling
+    if args.role == 'worker':
+        asyncio.run(run_worker(app, shared_update_queue, args.worker_index, args.workers))
+    elif getattr(config, 'WEBHOOK_ENABLED', False):
+        # Режим вебхука требует tornado (python-telegram-bot[webhooks])
+        from webhook import run_webhook
+        asyncio.run(run_webhook(app))
+    else:
+        app.run_polling()
 
 if __name__ == '__main__':
     main()
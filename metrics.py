@@ -0,0 +1,234 @@
+import functools
+import time
+from bisect import bisect_left
+
+# python-telegram-bot и tornado импортируются в функциях, которым они нужны:
+# обертки коллекций используются слоем данных и без них
+
+# Границы корзин гистограмм задержки (секунды)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Асинхронные методы коллекций motor, время которых измеряется
+COLLECTION_METHODS = frozenset({
+    'find_one', 'find_one_and_update', 'insert_one', 'insert_many',
+    'update_one', 'update_many', 'delete_one', 'delete_many', 'replace_one',
+    'bulk_write', 'count_documents', 'estimated_document_count', 'distinct',
+    'create_index',
+})
+# Операции GridFS, которые выполняются как отдельные запросы к базе
+BUCKET_METHODS = frozenset({'upload_from_stream', 'open_download_stream_by_name', 'delete'})
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Оценка квантиля по корзинам (верхняя граница корзины)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else float('inf')
+        return float('inf')
+
+
+class Registry:
+    """Счетчики и гистограммы в памяти процесса, отдаются в формате Prometheus."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.errors = {}
+        self.collectors = []
+
+    def observe(self, metric, labels, value):
+        key = (metric, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def error(self, metric, labels):
+        key = (metric, labels)
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+    def add_collector(self, collector):
+        """collector() возвращает список (имя, тип, значение) для метрик вне реестра."""
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        declared = set()
+        for (metric, labels), histogram in sorted(self.histograms.items()):
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f'# TYPE {metric} histogram')
+            label_text = format_labels(labels)
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS + (float('inf'),), histogram.counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{metric}_bucket{format_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{metric}_sum{label_text} {histogram.sum}')
+            lines.append(f'{metric}_count{label_text} {histogram.count}')
+        for (metric, labels), count in sorted(self.errors.items()):
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric}{format_labels(labels)} {count}')
+        for collector in self.collectors:
+            for name, metric_type, value in collector():
+                lines.append(f'# TYPE {name} {metric_type}')
+                lines.append(f'{name} {value}')
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+registry = Registry()
+
+
+# Обработчики
+
+def instrument_callback(callback, name):
+    from telegram.ext import ApplicationHandlerStop
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            registry.error("bot_handler_errors_total", (("handler", name),))
+            raise
+        finally:
+            registry.observe(
+                "bot_handler_duration_seconds", (("handler", name),), time.perf_counter() - started
+            )
+    wrapper.instrumented = True
+    return wrapper
+
+
+def instrument_handler(handler):
+    from telegram.ext import ConversationHandler
+
+    if isinstance(handler, ConversationHandler):
+        for inner in handler.entry_points + handler.fallbacks:
+            instrument_handler(inner)
+        for state_handlers in handler.states.values():
+            for inner in state_handlers:
+                instrument_handler(inner)
+    elif not getattr(handler.callback, 'instrumented', False):
+        name = getattr(handler.callback, '__name__', type(handler.callback).__name__)
+        handler.callback = instrument_callback(handler.callback, name)
+
+
+def instrument_application(application):
+    """Оборачивает все зарегистрированные обработчики замером времени и ошибок."""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            instrument_handler(handler)
+
+
+# Коллекции MongoDB
+
+class InstrumentedCursor:
+    """Курсор motor с замером времени загрузки результатов."""
+
+    def __init__(self, cursor, labels):
+        self.cursor = cursor
+        self.labels = labels
+
+    def __getattr__(self, name):
+        attr = getattr(self.cursor, name)
+        if name in ('sort', 'limit', 'skip', 'batch_size', 'hint'):
+            return lambda *args, **kwargs: InstrumentedCursor(attr(*args, **kwargs), self.labels)
+        return attr
+
+    async def to_list(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await self.cursor.to_list(*args, **kwargs)
+        finally:
+            registry.observe("bot_db_operation_duration_seconds", self.labels, time.perf_counter() - started)
+
+    async def __aiter__(self):
+        started = time.perf_counter()
+        try:
+            async for doc in self.cursor:
+                yield doc
+        finally:
+            registry.observe("bot_db_operation_duration_seconds", self.labels, time.perf_counter() - started)
+
+
+class InstrumentedCollection:
+    """Обертка коллекции motor, которая считает время и ошибки операций.
+
+    Подходит и для GridFS: у корзины нет имени, поэтому его передают
+    явно вместе с methods=BUCKET_METHODS.
+    """
+
+    def __init__(self, collection, name=None, methods=COLLECTION_METHODS):
+        self.collection = collection
+        self.label = name or collection.name
+        self.methods = methods
+
+    def __getattr__(self, name):
+        attr = getattr(self.collection, name)
+        labels = (("collection", self.label), ("operation", name))
+        if name in ('find', 'aggregate'):
+            return lambda *args, **kwargs: InstrumentedCursor(attr(*args, **kwargs), labels)
+        if name not in self.methods:
+            return attr
+
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await attr(*args, **kwargs)
+            except Exception:
+                registry.error("bot_db_errors_total", labels)
+                raise
+            finally:
+                registry.observe("bot_db_operation_duration_seconds", labels, time.perf_counter() - started)
+        return timed
+
+
+# HTTP
+
+def start_metrics_server(port, address='127.0.0.1'):
+    from tornado.httpserver import HTTPServer
+    from tornado.web import Application as WebApplication
+    from webhook import MetricsHandler
+
+    server = HTTPServer(WebApplication([("/metrics", MetricsHandler)]))
+    server.listen(port, address=address)
+    return server
+
+
+def summary(metric, limit=10):
+    """Строки вида (метки, число, среднее, p99) по самым нагруженным сериям метрики."""
+    rows = [
+        (labels, histogram.count, histogram.sum / histogram.count, histogram.quantile(0.99))
+        for (name, labels), histogram in registry.histograms.items()
+        if name == metric and histogram.count
+    ]
+    rows.sort(key=lambda row: row[1] * row[2], reverse=True)
+    return rows[:limit]
@@ -0,0 +1,129 @@
+import logging
+import time
+from collections import OrderedDict, deque
+
+import config
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, TypeHandler
+
+from cache import TTLCache, MISSING
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Не больше FLOOD_LIMIT обновлений от пользователя за FLOOD_WINDOW секунд (0 - без ограничения)
+FLOOD_LIMIT = getattr(config, 'FLOOD_LIMIT', 30)
+FLOOD_WINDOW = getattr(config, 'FLOOD_WINDOW', 10)
+# Повторное нажатие той же кнопки того же сообщения в течение этого времени отбрасывается
+CALLBACK_DEDUP_SECONDS = getattr(config, 'CALLBACK_DEDUP_SECONDS', 3)
+# Сколько пользователей и ключей помнить одновременно
+MIDDLEWARE_CACHE_SIZE = getattr(config, 'MIDDLEWARE_CACHE_SIZE', 10000)
+
+# Группа обработчиков, которая выполняется раньше всех остальных
+MIDDLEWARE_GROUP = -1
+
+
+class SlidingWindowLimiter:
+    """Скользящее окно: хранит времена последних обновлений каждого пользователя.
+
+    Число пользователей ограничено maxsize; дольше всех молчавшие вытесняются.
+    """
+
+    def __init__(self, limit, window, maxsize=MIDDLEWARE_CACHE_SIZE):
+        self.limit = limit
+        self.window = window
+        self.maxsize = maxsize
+        self.events = OrderedDict()
+        self.warned_at = {}
+
+    def allow(self, user_id, now=None):
+        now = now if now is not None else time.monotonic()
+        events = self.events.get(user_id)
+        if events is None:
+            events = self.events[user_id] = deque()
+            while len(self.events) > self.maxsize:
+                evicted, _ = self.events.popitem(last=False)
+                self.warned_at.pop(evicted, None)
+        else:
+            self.events.move_to_end(user_id)
+
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        if len(events) >= self.limit:
+            return False
+        events.append(now)
+        return True
+
+    def should_warn(self, user_id, now=None):
+        """Предупреждать о превышении не чаще раза за окно."""
+        now = now if now is not None else time.monotonic()
+        if self.warned_at.get(user_id, float('-inf')) > now - self.window:
+            return False
+        self.warned_at[user_id] = now
+        return True
+
+
+class UpdateGuard:
+    """Отбрасывает повторные и слишком частые обновления до основных обработчиков."""
+
+    def __init__(self, limit=FLOOD_LIMIT, window=FLOOD_WINDOW, dedup_seconds=CALLBACK_DEDUP_SECONDS):
+        self.limiter = SlidingWindowLimiter(limit, window) if limit else None
+        # update_id повторной доставки того же обновления (вебхук, общая очередь)
+        self.seen_updates = TTLCache(maxsize=MIDDLEWARE_CACHE_SIZE, ttl=max(window, 60))
+        # Ключ идемпотентности нажатия: пользователь, версия сообщения и данные кнопки
+        self.seen_callbacks = TTLCache(maxsize=MIDDLEWARE_CACHE_SIZE, ttl=dedup_seconds)
+
+    def drop(self, reason):
+        registry.error("bot_dropped_updates_total", (("reason", reason),))
+        raise ApplicationHandlerStop
+
+    async def answer_dropped(self, query):
+        """Снимает «часики» с кнопки отброшенного нажатия; действие не выполняется."""
+        if query is None:
+            return
+        try:
+            await query.answer()
+        except Exception as e:
+            # Запрос мог уже устареть или быть отвечен при первой доставке
+            logger.debug(f"Не удалось ответить на отброшенное нажатие {query.id}: {e}")
+
+    async def __call__(self, update: Update, context):
+        query = update.callback_query
+        if self.seen_updates.get(update.update_id) is not MISSING:
+            await self.answer_dropped(query)
+            self.drop("duplicate_update")
+        self.seen_updates.set(update.update_id, True)
+
+        user = update.effective_user
+        if user is None:
+            return
+
+        if query is not None and query.message is not None:
+            # edit_date отличает кнопки сообщения, отредактированного на месте,
+            # от повторного нажатия на ту же версию сообщения
+            message = query.message
+            edit_date = getattr(message, 'edit_date', None)
+            key = (user.id, message.chat.id, message.message_id, edit_date, query.data)
+            if self.seen_callbacks.get(key) is not MISSING:
+                await self.answer_dropped(query)
+                self.drop("duplicate_callback")
+            self.seen_callbacks.set(key, True)
+
+        if self.limiter is not None and not self.limiter.allow(user.id):
+            logger.info(f"Слишком частые запросы от пользователя {user.id}")
+            if self.limiter.should_warn(user.id):
+                text = "Слишком много запросов. Пожалуйста, подождите немного."
+                if query is not None:
+                    await query.answer(text)
+                elif update.effective_message is not None:
+                    await update.effective_message.reply_text(text)
+            else:
+                await self.answer_dropped(query)
+            self.drop("flood")
+
+
+def add_update_guard(application, guard=None):
+    """Регистрирует UpdateGuard в группе MIDDLEWARE_GROUP перед всеми обработчиками."""
+    guard = guard or UpdateGuard()
+    application.add_handler(TypeHandler(Update, guard), group=MIDDLEWARE_GROUP)
+    return guard
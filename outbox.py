@@ -0,0 +1,145 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+import config
+from pymongo import ASCENDING, InsertOne, ReturnDocument, UpdateOne
+
+from broadcast import send_with_retry
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз пытаться доставить сообщение, прежде чем отметить его как failed
+MAX_ATTEMPTS = getattr(config, 'OUTBOX_MAX_ATTEMPTS', 5)
+# На сколько секунд отправитель «забирает» сообщение; после сбоя его возьмет другой
+LEASE_SECONDS = getattr(config, 'OUTBOX_LEASE_SECONDS', 120)
+# Как часто проверять очередь, если новых сообщений не было (секунды)
+POLL_INTERVAL = getattr(config, 'OUTBOX_POLL_INTERVAL', 5)
+# Сколько дней хранить доставленные сообщения
+RETENTION_DAYS = getattr(config, 'OUTBOX_RETENTION_DAYS', 7)
+# Сколько сообщений отправлять параллельно
+CONCURRENCY = getattr(config, 'OUTBOX_CONCURRENCY', 4)
+
+
+class Outbox:
+    """Исходящие уведомления пользователям, записанные в MongoDB.
+
+    Сообщение добавляется той же транзакцией, что и изменение, о котором
+    оно сообщает, поэтому уведомление не потеряется при сбое после записи
+    и не уйдет, если запись откатилась. Отправляет их OutboxWorker.
+    """
+
+    def __init__(self, database):
+        self.collection = database.collection("outbox")
+        self.wakeup = asyncio.Event()
+
+    async def ensure_indexes(self):
+        await self.collection.create_index(
+            [("status", ASCENDING), ("next_attempt_at", ASCENDING)],
+            partialFilterExpression={"status": "pending"},
+        )
+        await self.collection.create_index(
+            [("sent_at", ASCENDING)], expireAfterSeconds=RETENTION_DAYS * 24 * 3600
+        )
+        # Ключ идемпотентности: одно уведомление на событие, сколько бы раз его ни ставили
+        await self.collection.create_index(
+            [("key", ASCENDING)], unique=True, partialFilterExpression={"key": {"$exists": True}}
+        )
+
+    def notify(self):
+        """Будит отправителей; внутри транзакции вызывается после ее фиксации."""
+        self.wakeup.set()
+
+    async def add_many(self, messages, session=None):
+        """Ставит в очередь сообщения вида (chat_id, text) или (chat_id, text, key).
+
+        Сообщение с ключом добавляется, только если сообщения с таким ключом
+        еще нет, поэтому повторная постановка того же уведомления безопасна.
+        """
+        if not messages:
+            return
+        now = datetime.now()
+        operations = []
+        for chat_id, text, *key in messages:
+            doc = {
+                "chat_id": chat_id,
+                "text": text,
+                "status": "pending",
+                "attempts": 0,
+                "next_attempt_at": now,
+                "created_at": now,
+            }
+            if key:
+                doc["key"] = key[0]
+                operations.append(UpdateOne({"key": key[0]}, {"$setOnInsert": doc}, upsert=True))
+            else:
+                operations.append(InsertOne(doc))
+        await self.collection.bulk_write(operations, ordered=False, session=session)
+        if session is None:
+            self.notify()
+
+    async def add(self, chat_id, text, session=None, key=None):
+        await self.add_many([(chat_id, text) if key is None else (chat_id, text, key)], session=session)
+
+    async def claim(self):
+        now = datetime.now()
+        return await self.collection.find_one_and_update(
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            {
+                "$set": {"next_attempt_at": now + timedelta(seconds=LEASE_SECONDS)},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def complete(self, message, delivered):
+        if delivered:
+            update = {"$set": {"status": "sent", "sent_at": datetime.now()}}
+        elif message['attempts'] >= MAX_ATTEMPTS:
+            update = {"$set": {"status": "failed"}}
+        else:
+            retry_at = datetime.now() + timedelta(seconds=30 * 2 ** message['attempts'])
+            update = {"$set": {"next_attempt_at": retry_at}}
+        await self.collection.update_one({"_id": message['_id']}, update)
+
+
+class OutboxWorker:
+    """Фоновая отправка сообщений из Outbox с учетом общих лимитов рассылки."""
+
+    def __init__(self, outbox, bot, concurrency=CONCURRENCY):
+        self.outbox = outbox
+        self.bot = bot
+        self.concurrency = concurrency
+        self.tasks = []
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.run()) for _ in range(self.concurrency)]
+
+    async def run(self):
+        while True:
+            self.outbox.wakeup.clear()
+            try:
+                message = await self.outbox.claim()
+            except Exception as e:
+                logger.error(f"Ошибка чтения очереди уведомлений: {e}")
+                message = None
+            if message is None:
+                try:
+                    await asyncio.wait_for(self.outbox.wakeup.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            delivered = await send_with_retry(self.bot, message['chat_id'], message['text'])
+            try:
+                await self.outbox.complete(message, delivered)
+            except Exception as e:
+                # Сообщение снова станет доступным по истечении LEASE_SECONDS
+                logger.error(f"Не удалось обновить уведомление {message['_id']}: {e}")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
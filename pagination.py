@@ -0,0 +1,80 @@
+from bisect import bisect_left, bisect_right
+
+import config
+from pymongo import ASCENDING, DESCENDING
+
+# Количество строк на одной странице списка
+PAGE_SIZE = getattr(config, 'PAGE_SIZE', 20)
+
+
+class Page:
+    """Одна страница списка с границами для перехода к соседним страницам."""
+
+    def __init__(self, items, first_key, last_key, has_prev, has_next):
+        self.items = items
+        self.first_key = first_key
+        self.last_key = last_key
+        self.has_prev = has_prev
+        self.has_next = has_next
+
+
+def keyset_filter(sort_keys, bound, operator):
+    """Условие «строго после/до `bound`» для составного ключа сортировки."""
+    clauses = []
+    for i, field in enumerate(sort_keys):
+        clause = {prev: value for prev, value in zip(sort_keys[:i], bound[:i])}
+        clause[field] = {operator: bound[i]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+
+async def fetch_page(collection, query, sort_keys, projection, after=None, before=None, page_size=PAGE_SIZE):
+    """Загружает одну страницу диапазонным запросом по индексированному ключу.
+
+    `after`/`before` - значения ключа сортировки у последней/первой строки
+    текущей страницы. Загружается не больше page_size + 1 документов.
+    """
+    backwards = before is not None
+    conditions = [query] if query else []
+    if after is not None:
+        conditions.append(keyset_filter(sort_keys, after, "$gt"))
+    elif backwards:
+        conditions.append(keyset_filter(sort_keys, before, "$lt"))
+    full_query = {"$and": conditions} if len(conditions) > 1 else (conditions[0] if conditions else {})
+
+    direction = DESCENDING if backwards else ASCENDING
+    cursor = collection.find(full_query, projection).sort(
+        [(field, direction) for field in sort_keys]
+    ).limit(page_size + 1)
+    docs = await cursor.to_list(length=page_size + 1)
+
+    has_more = len(docs) > page_size
+    docs = docs[:page_size]
+    if backwards:
+        docs.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = after is not None, has_more
+
+    if not docs:
+        return Page([], None, None, has_prev, has_next)
+    first_key = [docs[0][field] for field in sort_keys]
+    last_key = [docs[-1][field] for field in sort_keys]
+    return Page(docs, first_key, last_key, has_prev, has_next)
+
+
+def page_from_sorted(values, after=None, before=None, page_size=PAGE_SIZE):
+    """Страница из отсортированного списка строк с теми же правилами, что и fetch_page."""
+    if before is not None:
+        end = bisect_left(values, before[0])
+        start = max(end - page_size, 0)
+        has_prev, has_next = start > 0, True
+    else:
+        start = bisect_right(values, after[0]) if after is not None else 0
+        end = min(start + page_size, len(values))
+        has_prev, has_next = after is not None, end < len(values)
+
+    items = values[start:end]
+    if not items:
+        return Page([], None, None, has_prev, has_next)
+    return Page(items, [items[0]], [items[-1]], has_prev, has_next)
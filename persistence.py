@@ -0,0 +1,138 @@
+import asyncio
+import copy
+import logging
+
+import config
+from pymongo import DeleteOne, ReplaceOne
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# Задержка перед записью накопленных изменений (секунды)
+FLUSH_DELAY = getattr(config, 'PERSISTENCE_FLUSH_DELAY', 5)
+# Как часто Application передает изменения в хранилище (секунды)
+UPDATE_INTERVAL = getattr(config, 'PERSISTENCE_UPDATE_INTERVAL', 10)
+
+
+class MongoPersistence(BasePersistence):
+    """Хранит состояния разговоров, user_data, chat_data и bot_data в MongoDB.
+
+    Изменения копятся в памяти и записываются одним bulk_write на коллекцию
+    через FLUSH_DELAY секунд после первого изменения, а не по одной записи
+    на каждое обновление. В user_data должны лежать только простые значения
+    и id документов, а не сами документы.
+    """
+
+    def __init__(self, database, flush_delay=FLUSH_DELAY, update_interval=UPDATE_INTERVAL):
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self.collections = {
+            "user_data": database.collection("bot_user_data"),
+            "chat_data": database.collection("bot_chat_data"),
+            "bot_data": database.collection("bot_data"),
+            "conversations": database.collection("bot_conversations"),
+        }
+        self.flush_delay = flush_delay
+        # (имя коллекции, _id) -> документ для записи или None для удаления
+        self.pending = {}
+        self.flush_task = None
+        self.write_lock = asyncio.Lock()
+
+    # Загрузка
+
+    async def load_data(self, kind):
+        return {
+            doc["_id"]: doc.get("data", {})
+            async for doc in self.collections[kind].find()
+        }
+
+    async def get_user_data(self):
+        return await self.load_data("user_data")
+
+    async def get_chat_data(self):
+        return await self.load_data("chat_data")
+
+    async def get_bot_data(self):
+        doc = await self.collections["bot_data"].find_one({"_id": "bot_data"})
+        return doc.get("data", {}) if doc else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {
+            tuple(doc["key"]): doc["state"]
+            async for doc in self.collections["conversations"].find({"name": name})
+        }
+
+    # Сохранение
+
+    def schedule(self, kind, doc_id, doc):
+        self.pending[(kind, doc_id)] = doc
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.delayed_flush())
+
+    async def delayed_flush(self):
+        await asyncio.sleep(self.flush_delay)
+        # Дальше идет запись, отменять ее из flush() уже нельзя
+        self.flush_task = None
+        await self.write_pending()
+
+    async def write_pending(self):
+        async with self.write_lock:
+            pending, self.pending = self.pending, {}
+            operations = {}
+            for (kind, doc_id), doc in pending.items():
+                if doc is None:
+                    operation = DeleteOne({"_id": doc_id})
+                else:
+                    # Копия: обработчики могут менять данные, пока драйвер их сериализует
+                    operation = ReplaceOne({"_id": doc_id}, copy.deepcopy(doc), upsert=True)
+                operations.setdefault(kind, []).append(operation)
+
+            for kind, ops in operations.items():
+                try:
+                    await self.collections[kind].bulk_write(ops, ordered=False)
+                except Exception as e:
+                    logger.error(f"Не удалось сохранить {kind} ({len(ops)} записей): {e}")
+
+    async def update_user_data(self, user_id, data):
+        self.schedule("user_data", user_id, {"_id": user_id, "data": data})
+
+    async def update_chat_data(self, chat_id, data):
+        self.schedule("chat_data", chat_id, {"_id": chat_id, "data": data})
+
+    async def update_bot_data(self, data):
+        self.schedule("bot_data", "bot_data", {"_id": "bot_data", "data": data})
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        doc_id = f"{name}:{':'.join(map(str, key))}"
+        if new_state is None:
+            self.schedule("conversations", doc_id, None)
+        else:
+            self.schedule("conversations", doc_id, {
+                "_id": doc_id, "name": name, "key": list(key), "state": new_state,
+            })
+
+    async def drop_user_data(self, user_id):
+        self.schedule("user_data", user_id, None)
+
+    async def drop_chat_data(self, chat_id):
+        self.schedule("chat_data", chat_id, None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        await self.write_pending()
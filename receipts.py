@@ -0,0 +1,255 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import config
+
+from metrics import BUCKET_METHODS, InstrumentedCollection
+
+try:
+    from PIL import Image
+except ImportError:  # Без Pillow миниатюры не создаются, показывается оригинал
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Размер миниатюры квитанции для просмотра администратором (пиксели)
+THUMBNAIL_SIZE = getattr(config, 'RECEIPT_THUMBNAIL_SIZE', 640)
+# Сколько дней хранить квитанции обработанных запросов
+RETENTION_DAYS = getattr(config, 'RECEIPT_RETENTION_DAYS', 180)
+# Максимальный размер файла квитанции (байты)
+MAX_RECEIPT_SIZE = getattr(config, 'MAX_RECEIPT_SIZE', 10 * 1024 * 1024)
+
+# Сигнатуры допустимых форматов изображений (RIFF проверяется отдельно: это и WAV, и AVI)
+IMAGE_SIGNATURES = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n")
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ReceiptError(Exception):
+    """Файл квитанции не прошел проверку."""
+
+
+def validate_image(path):
+    """Проверяет размер и формат файла квитанции."""
+    size = os.path.getsize(path)
+    if size == 0 or size > MAX_RECEIPT_SIZE:
+        raise ReceiptError(f"недопустимый размер файла: {size} байт")
+    with open(path, 'rb') as file:
+        header = file.read(12)
+    is_webp = header[:4] == b"RIFF" and header[8:12] == b"WEBP"
+    if not (header.startswith(IMAGE_SIGNATURES) or is_webp):
+        raise ReceiptError("файл не является изображением")
+    if Image is not None:
+        try:
+            with Image.open(path) as image:
+                image.verify()
+        except Exception as e:
+            raise ReceiptError(f"поврежденное изображение: {e}") from e
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_thumbnail(source):
+    """Уменьшенная JPEG-копия изображения (путь или файловый объект) или None без Pillow."""
+    if Image is None:
+        return None
+    with Image.open(source) as image:
+        image = image.convert("RGB")
+        image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=80, optimize=True)
+        return output.getvalue()
+
+
+class LocalBackend:
+    """Хранит файлы квитанций в локальном каталоге."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    async def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def temp_path(self):
+        # Временный файл в том же каталоге, чтобы переименование было атомарным
+        fd, path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        return path
+
+    async def store_file(self, key, path):
+        os.replace(path, self.path(key))
+
+    async def write(self, key, data):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.write_sync, key, data)
+
+    def write_sync(self, key, data):
+        # Пишем во временный файл и переименовываем, чтобы не оставить половину файла
+        tmp_path = self.path(key) + ".tmp"
+        with open(tmp_path, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, self.path(key))
+
+    async def read(self, key):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.read_sync, key)
+
+    def read_sync(self, key):
+        with open(self.path(key), 'rb') as file:
+            return file.read()
+
+    async def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+class GridFSBackend:
+    """Хранит файлы квитанций в GridFS той же базы MongoDB."""
+
+    def __init__(self, database, bucket_name="receipts"):
+        from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+        self.bucket = InstrumentedCollection(
+            AsyncIOMotorGridFSBucket(database.db, bucket_name=bucket_name), name=bucket_name, methods=BUCKET_METHODS
+        )
+        self.files = database.collection(f"{bucket_name}.files")
+
+    async def exists(self, key):
+        return await self.files.find_one({"filename": key}, {"_id": 1}) is not None
+
+    def temp_path(self):
+        fd, path = tempfile.mkstemp(suffix=".tmp")
+        os.close(fd)
+        return path
+
+    async def store_file(self, key, path):
+        with open(path, 'rb') as file:
+            await self.bucket.upload_from_stream(key, file)
+        os.remove(path)
+
+    async def write(self, key, data):
+        await self.bucket.upload_from_stream(key, data)
+
+    async def read(self, key):
+        try:
+            stream = await self.bucket.open_download_stream_by_name(key)
+        except Exception as e:
+            raise FileNotFoundError(key) from e
+        return await stream.read()
+
+    async def delete(self, key):
+        async for doc in self.files.find({"filename": key}, {"_id": 1}):
+            await self.bucket.delete(doc["_id"])
+
+
+class ReceiptStore:
+    """Хранилище квитанций с адресацией по SHA-256 содержимого.
+
+    Одинаковые файлы хранятся один раз; миниатюра создается один раз при
+    загрузке и затем используется при каждом просмотре.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def original_key(digest):
+        return f"{digest}.jpg"
+
+    @staticmethod
+    def thumbnail_key(digest):
+        return f"{digest}_thumb.jpg"
+
+    def temp_path(self):
+        """Путь для скачивания новой квитанции перед вызовом save_file()."""
+        return self.backend.temp_path()
+
+    async def save_file(self, path):
+        """Проверяет и сохраняет скачанный файл, перенося его в хранилище.
+
+        Возвращает (хэш, был ли такой файл раньше). При ошибке проверки
+        бросает ReceiptError; временный файл в любом случае не остается.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, validate_image, path)
+            digest = await loop.run_in_executor(None, hash_file, path)
+            if await self.backend.exists(self.original_key(digest)):
+                return digest, True
+
+            try:
+                thumbnail = await loop.run_in_executor(None, make_thumbnail, path)
+            except Exception as e:
+                logger.warning(f"Не удалось создать миниатюру квитанции {digest}: {e}")
+                thumbnail = None
+            if thumbnail is not None:
+                await self.backend.write(self.thumbnail_key(digest), thumbnail)
+            await self.backend.store_file(self.original_key(digest), path)
+            return digest, False
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def read(self, digest, thumbnail=True):
+        """Содержимое квитанции; по умолчанию миниатюра, если она есть."""
+        if thumbnail:
+            try:
+                return await self.backend.read(self.thumbnail_key(digest))
+            except FileNotFoundError:
+                pass
+        return await self.backend.read(self.original_key(digest))
+
+    async def delete(self, digest):
+        await self.backend.delete(self.thumbnail_key(digest))
+        await self.backend.delete(self.original_key(digest))
+
+    async def collect_garbage(self, payment_requests, retention_days=RETENTION_DAYS):
+        """Удаляет квитанции обработанных запросов старше retention_days.
+
+        Файл удаляется, только если на тот же хэш не ссылается ни один
+        ожидающий или более свежий запрос. Возвращает число удаленных файлов.
+        """
+        threshold = datetime.now() - timedelta(days=retention_days)
+        expired = await payment_requests.distinct("receipt_hash", {
+            "status": {"$in": ["approved", "denied"]},
+            "resolved_at": {"$lt": threshold},
+            "receipt_purged": {"$ne": True},
+        })
+        removed = 0
+        for digest in expired:
+            still_used = await payment_requests.find_one({
+                "receipt_hash": digest,
+                "$or": [{"status": "pending"}, {"resolved_at": {"$gte": threshold}}],
+            }, {"_id": 1})
+            if still_used:
+                continue
+            await self.delete(digest)
+            await payment_requests.update_many(
+                {"receipt_hash": digest}, {"$set": {"receipt_purged": True}}
+            )
+            removed += 1
+        return removed
+
+
+def create_receipt_store(database):
+    """Хранилище квитанций по настройке config.RECEIPT_BACKEND ('local' или 'gridfs')."""
+    backend_name = getattr(config, 'RECEIPT_BACKEND', 'local')
+    if backend_name == 'gridfs':
+        return ReceiptStore(GridFSBackend(database))
+    return ReceiptStore(LocalBackend(getattr(config, 'RECEIPTS_DIR', 'receipts')))
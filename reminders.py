@@ -0,0 +1,128 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+import config
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+import ledger
+from broadcast import per_chat_limiter, send_with_retry
+
+logger = logging.getLogger(__name__)
+
+# Как часто проверять должников (часы)
+CHECK_INTERVAL_HOURS = getattr(config, 'REMINDER_CHECK_INTERVAL_HOURS', 24)
+# Не чаще одного напоминания пользователю за столько дней
+REMINDER_INTERVAL_DAYS = getattr(config, 'REMINDER_INTERVAL_DAYS', 7)
+# Сколько напоминаний отправлять параллельно в одной пачке
+BATCH_SIZE = getattr(config, 'REMINDER_BATCH_SIZE', 20)
+
+REMINDER_TEXT = (
+    "Напоминание: ваш долг по взносам составляет {debt} единиц.\n"
+    "Пожалуйста, внесите платеж и отправьте квитанцию командой /payment."
+)
+
+
+class DebtReminders:
+    """Периодические напоминания должникам.
+
+    Время последнего напоминания хранится в MongoDB (по документу на
+    пользователя с уникальным telegram_id), поэтому после перезапуска или
+    при нескольких рабочих процессах напоминание не уйдет дважды.
+    """
+
+    def __init__(self, database, interval_days=REMINDER_INTERVAL_DAYS):
+        self.users = database.users
+        self.state = database.collection("debt_reminders")
+        self.interval = timedelta(days=interval_days)
+
+    async def ensure_indexes(self):
+        await self.state.create_index([("telegram_id", ASCENDING)], unique=True)
+
+    def pipeline(self, now):
+        """Должники по расчету из ledger, которым давно не напоминали."""
+        required = ledger.total_required(now)
+        return [
+            {"$match": ledger.debtors_filter(now)},
+            {"$lookup": {
+                "from": self.state.name,
+                "localField": "telegram_id",
+                "foreignField": "telegram_id",
+                "as": "reminder",
+            }},
+            {"$match": {"$or": [
+                {"reminder": {"$size": 0}},
+                {"reminder.last_sent_at": {"$lt": now - self.interval}},
+            ]}},
+            {"$project": {
+                "_id": 0,
+                "telegram_id": 1,
+                "debt": {"$subtract": [required, {"$ifNull": ["$amount_paid", 0]}]},
+            }},
+        ]
+
+    async def claim(self, telegram_id, now):
+        """Атомарно отмечает напоминание; False, если его уже отправил кто-то другой."""
+        try:
+            await self.state.update_one(
+                {"telegram_id": telegram_id, "last_sent_at": {"$lt": now - self.interval}},
+                {"$set": {"last_sent_at": now}, "$inc": {"count": 1}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # Документ есть, но напоминание было недавно
+            return False
+        return True
+
+    async def remind(self, bot, debtor, now):
+        if not await self.claim(debtor['telegram_id'], now):
+            return None
+        delivered = await send_with_retry(bot, debtor['telegram_id'], REMINDER_TEXT.format(debt=debtor['debt']))
+        if not delivered:
+            await self.state.update_one(
+                {"telegram_id": debtor['telegram_id']}, {"$set": {"last_failed_at": now}}
+            )
+        return delivered
+
+    async def run(self, bot, now=None):
+        """Отправляет напоминания пачками. Возвращает пару (доставлено, не доставлено)."""
+        now = now or datetime.now()
+        sent = 0
+        failed = 0
+        batch = []
+
+        async def flush():
+            nonlocal sent, failed
+            for delivered in await asyncio.gather(*(self.remind(bot, debtor, now) for debtor in batch)):
+                if delivered:
+                    sent += 1
+                elif delivered is not None:
+                    failed += 1
+            batch.clear()
+
+        async for debtor in self.users.aggregate(self.pipeline(now)):
+            batch.append(debtor)
+            if len(batch) >= BATCH_SIZE:
+                await flush()
+        if batch:
+            await flush()
+        per_chat_limiter.prune()
+        return sent, failed
+
+
+async def debt_reminders_job(context):
+    reminders = context.job.data
+    sent, failed = await reminders.run(context.bot)
+    if sent or failed:
+        logger.info(f"Напоминания о долге: доставлено {sent}, не доставлено {failed}")
+
+
+def schedule_debt_reminders(job_queue, reminders, interval_hours=CHECK_INTERVAL_HOURS):
+    return job_queue.run_repeating(
+        debt_reminders_job,
+        interval=timedelta(hours=interval_hours),
+        first=timedelta(minutes=1),
+        data=reminders,
+        name="debt_reminders",
+    )
@@ -0,0 +1,173 @@
+import asyncio
+import codecs
+import csv
+import io
+import logging
+import tempfile
+from datetime import datetime
+
+import config
+
+import ledger
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # Без openpyxl доступен только CSV
+    Workbook = None
+
+logger = logging.getLogger(__name__)
+
+# Сколько должников выводить в рейтинге
+DEBTORS_LIMIT = getattr(config, 'REPORT_DEBTORS_LIMIT', 1000)
+# Файлы отчетов больше этого размера (байты) пишутся на диск, а не в память
+SPOOL_SIZE = 1024 * 1024
+# Строки CSV копятся в памяти и сбрасываются в файл кусками такого размера (символы)
+CSV_CHUNK_SIZE = 64 * 1024
+
+FORMATS = ('csv', 'xlsx') if Workbook is not None else ('csv',)
+
+
+class CsvReport:
+    """Отчет в одном CSV-файле: разделы идут друг за другом через пустую строку."""
+
+    extension = 'csv'
+
+    def __init__(self):
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        # BOM, чтобы Excel правильно открыл кириллицу. TextIOWrapper поверх
+        # SpooledTemporaryFile работает только с Python 3.11, поэтому строки
+        # собираются в StringIO и записываются в файл уже закодированными
+        self.file.write(codecs.BOM_UTF8)
+        self.chunk = io.StringIO()
+        self.writer = csv.writer(self.chunk)
+        self.sections = 0
+
+    def flush(self):
+        self.file.write(self.chunk.getvalue().encode('utf-8'))
+        self.chunk.seek(0)
+        self.chunk.truncate()
+
+    def section(self, title, header):
+        if self.sections:
+            self.writer.writerow([])
+        self.sections += 1
+        self.writer.writerow([title])
+        self.writer.writerow(header)
+
+    def row(self, values):
+        self.writer.writerow(values)
+        if self.chunk.tell() >= CSV_CHUNK_SIZE:
+            self.flush()
+
+    async def finish(self):
+        self.flush()
+        self.file.seek(0)
+        return self.file
+
+
+class XlsxReport:
+    """Отчет в XLSX: каждый раздел на своем листе, строки пишутся потоково."""
+
+    extension = 'xlsx'
+
+    def __init__(self):
+        self.workbook = Workbook(write_only=True)
+        self.sheet = None
+
+    def section(self, title, header):
+        self.sheet = self.workbook.create_sheet(title[:31])
+        self.sheet.append(header)
+
+    def row(self, values):
+        self.sheet.append(values)
+
+    async def finish(self):
+        file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        await asyncio.get_running_loop().run_in_executor(None, self.workbook.save, file)
+        file.seek(0)
+        return file
+
+
+def collected_pipeline():
+    return [
+        {"$group": {"_id": "$period", "collected": {"$sum": "$amount"}, "payments": {"$sum": 1}}},
+        {"$sort": {"_id": 1}},
+    ]
+
+
+def debtors_pipeline(today, limit=DEBTORS_LIMIT):
+    required = ledger.total_required(today)
+    return [
+        {"$match": ledger.debtors_filter(today)},
+        {"$project": {
+            "_id": 0,
+            "name": 1,
+            "telegram_id": 1,
+            "amount_paid": {"$ifNull": ["$amount_paid", 0]},
+            "debt": {"$subtract": [required, {"$ifNull": ["$amount_paid", 0]}]},
+        }},
+        {"$sort": {"debt": -1, "name": 1}},
+        {"$limit": limit},
+    ]
+
+
+def turnaround_pipeline():
+    return [
+        {"$match": {
+            "status": {"$in": ["approved", "denied"]},
+            "resolved_at": {"$type": "date"},
+            "created_at": {"$type": "date"},
+        }},
+        {"$project": {
+            "status": 1,
+            "month": {"$dateToString": {"format": "%Y-%m", "date": "$resolved_at"}},
+            "hours": {"$divide": [{"$subtract": ["$resolved_at", "$created_at"]}, 3600 * 1000]},
+        }},
+        {"$group": {
+            "_id": {"month": "$month", "status": "$status"},
+            "count": {"$sum": 1},
+            "avg_hours": {"$avg": "$hours"},
+            "max_hours": {"$max": "$hours"},
+        }},
+        {"$sort": {"_id.month": 1, "_id.status": 1}},
+    ]
+
+
+async def build_report(database, report_format='csv', today=None):
+    """Собирает финансовый отчет и возвращает (файловый объект, имя файла).
+
+    Все вычисления выполняются конвейерами агрегации в MongoDB, а строки
+    результата пишутся в файл по мере чтения курсора.
+    """
+    today = today or datetime.now()
+    report = XlsxReport() if report_format == 'xlsx' else CsvReport()
+    members = await database.users.count_documents({})
+
+    # Собрано по журналу против ожидаемого от всех текущих участников
+    report.section("Собрано по периодам", ["Период", "Платежей", "Собрано", "Ожидалось", "Разница"])
+    collected = {}
+    async for doc in database.ledger.aggregate(collected_pipeline()):
+        collected[doc['_id']] = doc
+    periods = [
+        ledger.add_months(ledger.payment_start_date, index).strftime("%Y-%m")
+        for index in range(ledger.periods_due(today))
+    ]
+    for period in sorted(set(periods) | {key for key in collected if key}):
+        doc = collected.get(period, {})
+        expected = ledger.required_payment * members if period in periods else 0
+        amount = doc.get('collected', 0)
+        report.row([period, doc.get('payments', 0), amount, expected, amount - expected])
+
+    report.section("Должники", ["Имя", "Telegram ID", "Внесено", "Долг"])
+    async for doc in database.users.aggregate(debtors_pipeline(today)):
+        report.row([doc.get('name', ''), doc.get('telegram_id'), doc['amount_paid'], doc['debt']])
+
+    report.section("Время рассмотрения платежей", ["Месяц", "Решение", "Запросов", "Среднее, ч", "Максимум, ч"])
+    async for doc in database.payment_requests.aggregate(turnaround_pipeline()):
+        report.row([
+            doc['_id']['month'], doc['_id']['status'], doc['count'],
+            round(doc['avg_hours'], 1), round(doc['max_hours'], 1),
+        ])
+
+    file = await report.finish()
+    return file, f"report_{today:%Y-%m-%d}.{report.extension}"
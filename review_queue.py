@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta
+
+import config
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+# На сколько администратор «забирает» запрос, пока его рассматривает
+LEASE_SECONDS = getattr(config, 'REVIEW_LEASE_SECONDS', 600)
+
+
+class ReviewQueue:
+    """Очередь ожидающих запросов в коллекции MongoDB.
+
+    Запросы выдаются по одному: find_one_and_update атомарно закрепляет
+    запрос за администратором на LEASE_SECONDS, поэтому два администратора
+    не получат один и тот же запрос. Отложенный запрос получает новое время
+    постановки в очередь и уходит в ее конец.
+    """
+
+    def __init__(self, collection, lease_seconds=LEASE_SECONDS):
+        self.collection = collection
+        self.lease = timedelta(seconds=lease_seconds)
+
+    def held_filter(self, reviewer_id):
+        """Условие «запрос ожидает решения и закреплен за администратором»."""
+        return {
+            "status": "pending",
+            "claimed_by": reviewer_id,
+            "lease_until": {"$gt": datetime.now()},
+        }
+
+    async def current(self, reviewer_id):
+        """Запрос, который сейчас закреплен за администратором, или None."""
+        return await self.collection.find_one(self.held_filter(reviewer_id))
+
+    async def held(self, request_id, reviewer_id):
+        """Запрос request_id, если он все еще закреплен за администратором, иначе None."""
+        return await self.collection.find_one({"_id": request_id, **self.held_filter(reviewer_id)})
+
+    async def claim_next(self, reviewer_id):
+        """Закрепляет за администратором следующий свободный запрос."""
+        now = datetime.now()
+        return await self.collection.find_one_and_update(
+            {
+                "status": "pending",
+                "$or": [
+                    {"claimed_by": None},
+                    {"claimed_by": reviewer_id},
+                    {"lease_until": {"$lte": now}},
+                ],
+            },
+            {"$set": {"claimed_by": reviewer_id, "lease_until": now + self.lease}},
+            sort=[("queued_at", 1), ("_id", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def current_or_next(self, reviewer_id):
+        return await self.current(reviewer_id) or await self.claim_next(reviewer_id)
+
+    async def postpone(self, request_id, reviewer_id):
+        """Возвращает запрос в конец очереди."""
+        await self.collection.update_one(
+            {"_id": request_id, "claimed_by": reviewer_id},
+            {
+                "$set": {"queued_at": datetime.now()},
+                "$unset": {"claimed_by": "", "lease_until": ""},
+            },
+        )
+
+    async def release(self, reviewer_id):
+        """Снимает с администратора все закрепленные запросы."""
+        await self.collection.update_many(
+            {"status": "pending", "claimed_by": reviewer_id},
+            {"$unset": {"claimed_by": "", "lease_until": ""}},
+        )
+
+    async def resolve(self, request_id, status, session=None, **fields):
+        """Переводит запрос из pending в `status`.
+
+        Возвращает False, если запрос уже был обработан кем-то другим.
+        """
+        result = await self.collection.update_one(
+            {"_id": request_id, "status": "pending"},
+            {
+                "$set": {"status": status, "resolved_at": datetime.now(), **fields},
+                "$unset": {"claimed_by": "", "lease_until": ""},
+            },
+            session=session,
+        )
+        return result.modified_count == 1
+
+    async def resolve_many(self, request_ids, status, session=None, held_by=None, **fields):
+        """Переводит сразу несколько запросов из pending в `status`.
+
+        Возвращает документы тех запросов, которые перевел именно этот вызов:
+        они помечаются общим resolution_batch, так что уже обработанные
+        другими администраторами запросы в результат не попадают. С held_by
+        переводятся только запросы, закрепленные за этим администратором.
+        """
+        batch = ObjectId()
+        query = self.held_filter(held_by) if held_by is not None else {"status": "pending"}
+        await self.collection.update_many(
+            {"_id": {"$in": list(request_ids)}, **query},
+            {
+                "$set": {"status": status, "resolved_at": datetime.now(), "resolution_batch": batch, **fields},
+                "$unset": {"claimed_by": "", "lease_until": ""},
+            },
+            session=session,
+        )
+        return await self.collection.find(
+            {"_id": {"$in": list(request_ids)}, "resolution_batch": batch}, session=session
+        ).to_list(None)
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import os
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+
+class Roster:
+    """Неизменяемый отсортированный список членов клуба с быстрой проверкой имени."""
+
+    def __init__(self, names):
+        self.names = tuple(sorted({name.strip() for name in names if name.strip()}))
+        self.index = frozenset(self.names)
+        # Отсортированные пары (слово имени в нижнем регистре, позиция имени)
+        # для поиска по началу любого слова: «ива» найдет «Иванов Петр»
+        words = sorted(
+            (word, position)
+            for position, name in enumerate(self.names)
+            for word in name.casefold().split()
+        )
+        self.words = [word for word, _ in words]
+        self.word_positions = [position for _, position in words]
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'r', encoding='utf-8') as file:
+            return cls(file.read().splitlines())
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def position(self, name):
+        """Позиция имени (или места, куда бы оно встало) в отсортированном списке."""
+        return bisect_left(self.names, name)
+
+    def search(self, query, limit=None):
+        """Имена, у которых каждое слово запроса - начало какого-то слова имени.
+
+        Возвращает совпадения в алфавитном порядке; стоимость - O(log N)
+        на поиск первого слова плюс число совпадений.
+        """
+        query_words = query.casefold().split()
+        if not query_words:
+            return []
+        first, rest = query_words[0], query_words[1:]
+
+        positions = set()
+        i = bisect_left(self.words, first)
+        while i < len(self.words) and self.words[i].startswith(first):
+            positions.add(self.word_positions[i])
+            i += 1
+
+        matches = []
+        for position in sorted(positions):
+            name = self.names[position]
+            if rest:
+                name_words = name.casefold().split()
+                if not all(any(word.startswith(q) for word in name_words) for q in rest):
+                    continue
+            matches.append(name)
+            if limit is not None and len(matches) >= limit:
+                break
+        return matches
+
+    def unregistered(self, registered_names):
+        """Имена из списка клуба, которых нет среди `registered_names`, по алфавиту."""
+        registered = registered_names if isinstance(registered_names, (set, frozenset)) else set(registered_names)
+        return [name for name in self.names if name not in registered]
+
+
+class RosterProvider:
+    """Держит актуальный Roster и подменяет его при изменении файла.
+
+    Новый список строится целиком и затем подставляется одним присваиванием,
+    поэтому обработчики всегда видят либо старый, либо новый список целиком.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Файл читается при запуске вызовом load(), до него список пуст
+        self.signature = None
+        self.roster = Roster(())
+        self.task = None
+
+    def file_signature(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    async def load(self):
+        """Первое чтение списка: без файла бот работать не может, поэтому ошибки не глушатся."""
+        signature = self.file_signature()
+        loop = asyncio.get_running_loop()
+        self.roster = await loop.run_in_executor(None, Roster.from_file, self.path)
+        self.signature = signature
+        logger.info(f"Список клуба загружен: {len(self.roster)} имен")
+
+    async def reload_if_changed(self):
+        try:
+            signature = self.file_signature()
+        except FileNotFoundError:
+            logger.warning(f"Файл со списком клуба {self.path} не найден, оставляем текущий список")
+            return False
+        if signature == self.signature:
+            return False
+
+        loop = asyncio.get_running_loop()
+        roster = await loop.run_in_executor(None, Roster.from_file, self.path)
+        self.roster = roster
+        self.signature = signature
+        logger.info(f"Список клуба перечитан: {len(roster)} имен")
+        return True
+
+    async def watch(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reload_if_changed()
+            except Exception as e:
+                logger.error(f"Не удалось перечитать список клуба: {e}")
+
+    def start(self, interval):
+        self.task = asyncio.create_task(self.watch(interval))
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+def bench_unregistered(size=10_000, registered_share=0.5, repeat=20):
+    """Микробенчмарк: set-разность против старого поиска по списку.
+
+    Возвращает список нарушений: результаты обоих вариантов и поиска по
+    имени должны совпадать с прямым перебором.
+    """
+    import timeit
+
+    names = [f"Участник {i:06d}" for i in range(size)]
+    registered = names[::int(1 / registered_share)]
+    roster = Roster(names)
+
+    new_time = timeit.timeit(lambda: roster.unregistered(registered), number=repeat) / repeat
+    # Старый вариант O(N·M) на порядки медленнее, поэтому мерим один прогон
+    old_time = timeit.timeit(lambda: [n for n in names if n not in registered], number=1)
+    print(f"{size} имен, {len(registered)} зарегистрировано")
+    print(f"  set-разность: {new_time * 1000:.2f} мс")
+    print(f"  поиск по списку: {old_time * 1000:.2f} мс")
+
+    errors = []
+    expected = [n for n in names if n not in registered]
+    if roster.unregistered(registered) != expected:
+        errors.append(f"{size}: unregistered() расходится с перебором")
+    for query in ("участник", "участник 0000", f"{size - 1:06d}", "нет такого"):
+        words = query.casefold().split()
+        expected = [
+            n for n in names
+            if all(any(word.startswith(q) for word in n.casefold().split()) for q in words)
+        ]
+        if roster.search(query) != expected:
+            errors.append(f"{size}: search({query!r}) расходится с перебором")
+    return errors
+
+
+if __name__ == '__main__':
+    import sys
+
+    failures = []
+    for size in (1_000, 10_000, 20_000):
+        failures += bench_unregistered(size)
+    for failure in failures:
+        print(f"ОШИБКА: {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+import config
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from telegram import Bot, Update
+
+logger = logging.getLogger(__name__)
+
+# Число разделов очереди; чат всегда попадает в один и тот же раздел
+PARTITIONS = getattr(config, 'QUEUE_PARTITIONS', 64)
+# Через сколько секунд зависшее в обработке обновление можно взять снова
+PROCESSING_TIMEOUT = getattr(config, 'QUEUE_PROCESSING_TIMEOUT', 120)
+# Максимальная пауза между опросами пустого раздела (секунды)
+MAX_POLL_INTERVAL = getattr(config, 'QUEUE_MAX_POLL_INTERVAL', 1.0)
+
+
+def update_chat_id(update):
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return 0
+
+
+class SharedUpdateQueue:
+    """Очередь обновлений в MongoDB, разбитая на разделы по id чата.
+
+    Каждый раздел читает ровно один рабочий процесс и строго по порядку
+    update_id, поэтому обновления одного пользователя обрабатываются
+    последовательно, а разные разделы - параллельно.
+    """
+
+    def __init__(self, database, partitions=PARTITIONS):
+        self.collection = database.collection("update_queue")
+        self.partitions = partitions
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("partition", ASCENDING), ("_id", ASCENDING)])
+
+    async def put(self, data, bot=None):
+        update = Update.de_json(data, bot)
+        chat_id = update_chat_id(update)
+        try:
+            await self.collection.insert_one({
+                "_id": update.update_id,
+                "partition": chat_id % self.partitions,
+                "data": data,
+                "status": "queued",
+                "created_at": datetime.now(),
+            })
+        except DuplicateKeyError:
+            # Telegram повторил доставку того же обновления
+            pass
+
+    async def claim(self, partition, worker_id):
+        """Берет самое старое обновление раздела, если предыдущее уже обработано."""
+        now = datetime.now()
+        head = await self.collection.find_one({"partition": partition}, sort=[("_id", 1)])
+        if head is None:
+            return None
+        if head["status"] == "processing" and head["locked_until"] > now:
+            return None
+        return await self.collection.find_one_and_update(
+            {"_id": head["_id"], "status": head["status"]},
+            {"$set": {
+                "status": "processing",
+                "locked_by": worker_id,
+                "locked_until": now + timedelta(seconds=PROCESSING_TIMEOUT),
+            }},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def done(self, update_id):
+        await self.collection.delete_one({"_id": update_id})
+
+    async def size(self):
+        return await self.collection.estimated_document_count()
+
+
+async def consume_partition(application, queue, partition, worker_id, stop_event):
+    interval = 0.05
+    while not stop_event.is_set():
+        try:
+            doc = await queue.claim(partition, worker_id)
+        except Exception as e:
+            logger.error(f"Ошибка чтения раздела {partition}: {e}")
+            doc = None
+        if doc is None:
+            try:
+                await asyncio.wait_for(stop_event.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+            continue
+
+        interval = 0.05
+        try:
+            await application.process_update(Update.de_json(doc["data"], application.bot))
+        except Exception as e:
+            logger.error(f"Ошибка обработки обновления {doc['_id']}: {e}")
+        await queue.done(doc["_id"])
+
+
+async def run_worker(application, queue, worker_index, worker_count):
+    """Рабочий процесс: обрабатывает разделы partition % worker_count == worker_index."""
+    from webhook import start_application, stop_application, stop_signal_event
+
+    stop_event = stop_signal_event()
+    partitions = [p for p in range(queue.partitions) if p % worker_count == worker_index]
+    worker_id = f"worker-{worker_index}"
+
+    await start_application(application)
+    logger.info(f"{worker_id}: разделы {partitions[0]}..{partitions[-1]} (всего {len(partitions)})")
+    try:
+        await asyncio.gather(*(
+            consume_partition(application, queue, partition, worker_id, stop_event)
+            for partition in partitions
+        ))
+    finally:
+        await stop_application(application)
+
+
+async def run_ingress(queue):
+    """Прием вебхуков без обработки: обновления только складываются в очередь."""
+    # tornado нужен только ролям с HTTP-сервером
+    from webhook import (
+        check_webhook_settings,
+        make_web_app,
+        register_webhook,
+        serve_until_stopped,
+        stop_signal_event,
+    )
+
+    check_webhook_settings()
+    stop_event = stop_signal_event()
+    bot = Bot(config.TOKEN)
+    await queue.ensure_indexes()
+
+    async def sink(data):
+        await queue.put(data, bot)
+
+    async def status():
+        return True, {"update_queue": await queue.size()}
+
+    async with bot:
+        await register_webhook(bot)
+        await serve_until_stopped(make_web_app(sink, status), stop_event)
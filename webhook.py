@@ -0,0 +1,204 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+import time
+
+import config
+from telegram import Update
+from tornado.httpserver import HTTPServer
+from tornado.web import Application as WebApplication, RequestHandler
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Настройки режима вебхука
+WEBHOOK_LISTEN = getattr(config, 'WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = getattr(config, 'WEBHOOK_PORT', 8080)
+WEBHOOK_PATH = getattr(config, 'WEBHOOK_PATH', '/telegram')
+# Публичный адрес за обратным прокси; если не задан, вебхук в Telegram не регистрируется
+WEBHOOK_URL = getattr(config, 'WEBHOOK_URL', None)
+WEBHOOK_SECRET = getattr(config, 'WEBHOOK_SECRET', None)
+# Обрабатывать обновление до ответа на запрос (для замера задержки обработчиков)
+WEBHOOK_PROCESS_INLINE = getattr(config, 'WEBHOOK_PROCESS_INLINE', False)
+
+
+class TelegramUpdateHandler(RequestHandler):
+    """Принимает обновления от Telegram и передает их в `sink`."""
+
+    def initialize(self, sink, secret_token):
+        self.sink = sink
+        self.secret_token = secret_token
+
+    async def post(self):
+        if self.secret_token:
+            received = self.request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not hmac.compare_digest(received, self.secret_token):
+                self.set_status(403)
+                return
+
+        try:
+            data = json.loads(self.request.body)
+        except ValueError as e:
+            logger.warning(f"Некорректное обновление в вебхуке: {e}")
+            self.set_status(400)
+            return
+
+        await self.sink(data)
+        self.set_status(200)
+
+
+class MetricsHandler(RequestHandler):
+    """Метрики процесса в текстовом формате Prometheus."""
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(registry.render())
+
+
+class HealthHandler(RequestHandler):
+    """Проверка работоспособности для балансировщика или оркестратора."""
+
+    def initialize(self, status, started_at):
+        self.status = status
+        self.started_at = started_at
+
+    async def get(self):
+        healthy, details = await self.status()
+        self.set_status(200 if healthy else 503)
+        self.write({
+            "status": "ok" if healthy else "unavailable",
+            "uptime": round(time.monotonic() - self.started_at, 1),
+            **details,
+        })
+
+
+def make_web_app(sink, status, secret_token=WEBHOOK_SECRET, path=WEBHOOK_PATH):
+    return WebApplication([
+        (path, TelegramUpdateHandler, {"sink": sink, "secret_token": secret_token}),
+        ("/health", HealthHandler, {"status": status, "started_at": time.monotonic()}),
+        ("/metrics", MetricsHandler),
+    ])
+
+
+def stop_signal_event():
+    """Событие, которое устанавливается по SIGINT/SIGTERM."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:  # Windows
+            pass
+    return stop_event
+
+
+def check_webhook_settings():
+    """Не дает зарегистрировать публичный вебхук без секретного токена."""
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        raise RuntimeError(
+            "Задан WEBHOOK_URL, но не задан WEBHOOK_SECRET: без него любой может "
+            "отправлять боту поддельные обновления"
+        )
+
+
+async def register_webhook(bot):
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            url=WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+
+
+async def serve_until_stopped(web_app, stop_event):
+    server = HTTPServer(web_app)
+    server.listen(WEBHOOK_PORT, address=WEBHOOK_LISTEN)
+    logger.info(f"Вебхук слушает {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        await stop_event.wait()
+    finally:
+        logger.info("Остановка вебхука")
+        server.stop()
+        await server.close_all_connections()
+
+
+async def start_application(application):
+    """Запуск Application без Updater, как это делает run_polling."""
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+
+async def stop_application(application):
+    await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+async def run_webhook(application):
+    """Запускает бота в режиме вебхука и останавливает его по SIGINT/SIGTERM."""
+    check_webhook_settings()
+    stop_event = stop_signal_event()
+
+    async def sink(data):
+        update = Update.de_json(data, application.bot)
+        if WEBHOOK_PROCESS_INLINE:
+            await application.process_update(update)
+        else:
+            await application.update_queue.put(update)
+
+    async def status():
+        return application.running, {"update_queue": application.update_queue.qsize()}
+
+    await start_application(application)
+    await register_webhook(application.bot)
+    try:
+        # Сначала перестаем принимать обновления, затем дорабатываем очередь
+        await serve_until_stopped(make_web_app(sink, status), stop_event)
+    finally:
+        await stop_application(application)
+
+
+async def replay_updates(path, url, secret_token=WEBHOOK_SECRET):
+    """Отправляет записанные обновления (JSON-массив или JSON на строку) на вебхук.
+
+    Печатает время ответа на каждое обновление; при WEBHOOK_PROCESS_INLINE
+    оно включает время работы обработчиков.
+    """
+    import httpx
+
+    with open(path, 'r', encoding='utf-8') as file:
+        text = file.read().strip()
+    updates = json.loads(text) if text.startswith('[') else [json.loads(line) for line in text.splitlines() if line]
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret_token} if secret_token else {}
+    timings = []
+    async with httpx.AsyncClient() as client:
+        for data in updates:
+            started = time.perf_counter()
+            response = await client.post(url, json=data, headers=headers)
+            elapsed = time.perf_counter() - started
+            timings.append(elapsed)
+            print(f"update {data.get('update_id')}: {response.status_code}, {elapsed * 1000:.1f} мс")
+
+    if timings:
+        timings.sort()
+        print(f"Всего {len(timings)}, медиана {timings[len(timings) // 2] * 1000:.1f} мс, "
+              f"максимум {timings[-1] * 1000:.1f} мс")
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) < 2:
+        print("Использование: python webhook.py updates.json [url]")
+        sys.exit(1)
+    target = sys.argv[2] if len(sys.argv) > 2 else f"http://{WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}"
+    asyncio.run(replay_updates(sys.argv[1], target))
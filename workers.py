@@ -0,0 +1,53 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool:
+    """Ограниченный пул фоновых задач поверх asyncio.Queue.
+
+    Одновременно выполняется не больше `size` задач, в очереди ждет не
+    больше `queue_size`; при переполнении submit() сразу возвращает False.
+    """
+
+    def __init__(self, name, size, queue_size):
+        self.name = name
+        self.size = size
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.tasks = []
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.size)]
+
+    def submit(self, func, *args):
+        try:
+            self.queue.put_nowait((func, args))
+            return True
+        except asyncio.QueueFull:
+            logger.warning(f"Очередь {self.name} переполнена")
+            return False
+
+    async def put(self, func, *args):
+        """Как submit(), но при переполнении ждет свободного места."""
+        await self.queue.put((func, args))
+
+    async def worker(self):
+        while True:
+            func, args = await self.queue.get()
+            try:
+                await func(*args)
+            except Exception as e:
+                logger.error(f"Ошибка фоновой задачи {self.name}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def stop(self, timeout=30):
+        """Дожидается уже поставленных задач (не дольше timeout) и останавливает пул."""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не все задачи {self.name} завершены до остановки")
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []